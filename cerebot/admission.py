@@ -0,0 +1,219 @@
+"""Admission control for chat commands when the bot is overloaded."""
+
+import asyncio
+import collections
+import logging
+import time
+
+from .metrics import metrics
+
+_log = logging.getLogger()
+
+# Load levels, from least to most loaded. At each level the kinds of message
+# of all lower levels are also limited.
+NORMAL_LOAD = 0
+# Cosmetic bot commands like !dance are ignored.
+SHED_COSMETIC = 1
+# Unlogged bot commands are queued until load drops.
+DEFER_UNLOGGED = 2
+# Relay queries are refused with a short reply.
+REJECT_RELAY = 3
+
+# Actions taken on a message.
+ADMIT = "admitted"
+DROP = "dropped"
+DEFER = "deferred"
+REJECT = "rejected"
+
+# Kinds of incoming message.
+ADMIN_MESSAGE = "admin"
+COSMETIC_COMMAND = "cosmetic"
+UNLOGGED_COMMAND = "unlogged"
+BOT_COMMAND = "command"
+RELAY_QUERY = "relay"
+
+# The reply sent when a relay query is refused, and the least time between
+# these replies in any one channel.
+_busy_text = "I'm busy right now, please try again in a minute."
+_busy_notice_interval = 30
+
+metrics.describe("discord_event_loop_lag_seconds",
+                 "Smoothed delay of the event loop in running ready tasks.")
+metrics.describe("discord_outbound_pending",
+                 "Discord API calls sending or editing messages that have "
+                 "not completed.")
+metrics.describe("discord_load_level",
+                 "Admission control level, from 0 (normal) to 3 (refusing "
+                 "relay queries).")
+metrics.describe("discord_deferred_commands",
+                 "Bot commands waiting for load to drop.")
+metrics.describe("discord_shed_messages_total",
+                 "Chat messages not handled normally due to load, by message "
+                 "kind and action taken.")
+
+
+class AdmissionController:
+    """Decides whether incoming chat is handled, deferred, or dropped, based
+    on event loop lag and the number of pending outgoing API calls.
+
+    The load is the larger of the lag divided by `shed_lag` and the pending
+    calls divided by `shed_queue_depth`, and each whole multiple of these
+    thresholds raises the load level by one. A threshold of 0 disables that
+    measure. Commands that require an admin and messages from admins are
+    always handled."""
+
+    def __init__(self, manager, conf):
+        self.manager = manager
+        self.lag_threshold = conf.get("shed_lag", 0.25)
+        self.depth_threshold = conf.get("shed_queue_depth", 20)
+        self.defer_limit = conf.get("shed_defer_limit", 50)
+        self.defer_timeout = conf.get("shed_defer_timeout", 30)
+        self.probe_interval = 0.5
+
+        self.lag = 0
+        self.level = NORMAL_LOAD
+        # Entries are (time queued, source, user, message).
+        self.deferred = collections.deque()
+        # Time of the last busy reply in each channel, keyed by channel ID.
+        self.busy_notices = {}
+
+    def update_level(self):
+        load = 0
+        if self.lag_threshold:
+            load = self.lag / self.lag_threshold
+        if self.depth_threshold:
+            load = max(load,
+                       self.manager.outbound_pending / self.depth_threshold)
+        level = min(REJECT_RELAY, int(load))
+        if level != self.level:
+            log = _log.warning if level > self.level else _log.info
+            log("Discord: Load level changed from %s to %s (lag %.3fs, %s "
+                "pending sends)", self.level, level, self.lag,
+                self.manager.outbound_pending)
+            self.level = level
+            metrics.set("discord_load_level", level)
+
+        return level
+
+    def classify(self, source, user, message):
+        """Return the kind of a chat message, or None if it's neither a bot
+        command nor a relay query."""
+
+        prefix = source.bot_command_prefix
+        if message.startswith(prefix):
+            words = message[len(prefix):].split(None, 1)
+            entry = self.manager.bot_commands.get(words[0]) if words else None
+            if entry:
+                if (entry.get("require_admin")
+                        or self.manager.user_is_admin(user)):
+                    return ADMIN_MESSAGE
+
+                if entry.get("cosmetic"):
+                    return COSMETIC_COMMAND
+
+                if entry.get("unlogged"):
+                    return UNLOGGED_COMMAND
+
+                return BOT_COMMAND
+
+        if self.manager.dcss_manager.is_dcss_message(message):
+            if self.manager.user_is_admin(user):
+                return ADMIN_MESSAGE
+
+            return RELAY_QUERY
+
+    async def admit(self, source, user, message, kind):
+        """Decide what to do with a message of the kind returned by
+        classify(), returning ADMIT if it should be handled now. Otherwise the
+        message has been dropped (DROP), deferred (DEFER), or answered with a
+        busy reply (REJECT)."""
+
+        if self.update_level() == NORMAL_LOAD:
+            return ADMIT
+
+        if kind == COSMETIC_COMMAND:
+            metrics.inc("discord_shed_messages_total", kind=kind,
+                        action=DROP)
+            return DROP
+
+        if kind == UNLOGGED_COMMAND and self.level >= DEFER_UNLOGGED:
+            return self.defer(source, user, message)
+
+        if kind == RELAY_QUERY and self.level >= REJECT_RELAY:
+            metrics.inc("discord_shed_messages_total", kind=kind,
+                        action=REJECT)
+            await self.send_busy_notice(source)
+            return REJECT
+
+        return ADMIT
+
+    def defer(self, source, user, message):
+        if len(self.deferred) >= self.defer_limit:
+            metrics.inc("discord_shed_messages_total", kind=UNLOGGED_COMMAND,
+                        action=DROP)
+            return DROP
+
+        self.deferred.append((time.monotonic(), source, user, message))
+        metrics.inc("discord_shed_messages_total", kind=UNLOGGED_COMMAND,
+                    action=DEFER)
+        metrics.set("discord_deferred_commands", len(self.deferred))
+        return DEFER
+
+    async def send_busy_notice(self, source):
+        now = time.monotonic()
+        channel_id = source.channel.id
+        if now - self.busy_notices.get(channel_id, 0) < _busy_notice_interval:
+            return
+
+        self.busy_notices[channel_id] = now
+        await source.send_chat(_busy_text)
+
+    def run_deferred(self):
+        """Start any deferred commands that haven't timed out, as long as load
+        allows it."""
+
+        now = time.monotonic()
+        while self.deferred and self.level < DEFER_UNLOGGED:
+            queued, source, user, message = self.deferred.popleft()
+            if now - queued >= self.defer_timeout:
+                metrics.inc("discord_shed_messages_total",
+                            kind=UNLOGGED_COMMAND, action="expired")
+                continue
+
+            asyncio.ensure_future(self.run_command(source, user, message))
+
+        metrics.set("discord_deferred_commands", len(self.deferred))
+
+    async def run_command(self, source, user, message):
+        try:
+            await self.manager.run_chat(source, user, message,
+                                        UNLOGGED_COMMAND)
+
+        except Exception:
+            self.manager.log_exception("Unable to run deferred command")
+
+    async def run(self):
+        """Measure event loop lag and start deferred commands."""
+
+        loop = asyncio.get_event_loop()
+        while not self.manager.is_closed:
+            start = loop.time()
+            await asyncio.sleep(self.probe_interval)
+            lag = max(0, loop.time() - start - self.probe_interval)
+            # Rise at once with the lag but fall gradually, so that the level
+            # doesn't swing between every probe.
+            if lag >= self.lag:
+                self.lag = lag
+            else:
+                self.lag = 0.8 * self.lag + 0.2 * lag
+
+            metrics.set("discord_event_loop_lag_seconds", self.lag)
+            metrics.set("discord_outbound_pending",
+                        self.manager.outbound_pending)
+            self.update_level()
+            self.run_deferred()
+
+            cutoff = time.monotonic() - _busy_notice_interval
+            for channel_id, t in list(self.busy_notices.items()):
+                if t < cutoff:
+                    del self.busy_notices[channel_id]
@@ -6,24 +6,24 @@ knowledge bots for DCSS.
 """
 
 import argparse
-
 import asyncio
-if hasattr(asyncio, "async"):
-    ensure_future = asyncio.async
-else:
-    ensure_future = asyncio.ensure_future
-
 import functools
 import logging
 import os
 import signal
 import sys
+import time
 import traceback
 
+# Taken before the remaining imports so that the startup profile includes them.
+_start_time = time.perf_counter()
+
 from beem.dcss import DCSSManager
 
-from .discord import DiscordManager
 from .config import CerebotConfig
+from .metrics import metrics
+from .snapshot import load_snapshot
+from .startup import StartupProfile
 from .version import version
 
 ## Will be configured by Cerebot after the config is loaded.
@@ -31,18 +31,43 @@ _log = logging.getLogger()
 
 _DEFAULT_CONFIG_FILE = "cerebot_config.toml"
 
+def new_event_loop(use_uvloop=False):
+    """Create and install a new event loop. If use_uvloop is true and the
+    uvloop module is available, this will be a uvloop event loop."""
+
+    if use_uvloop:
+        try:
+            import uvloop
+
+        except ImportError:
+            _log.warning("App: uvloop is not installed, using the default "
+                         "asyncio event loop")
+
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
 class Cerebot:
     """Cerebot. Load the configuration and runs the tasks for the DCSS
     and Discord managers.
 
     """
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, use_uvloop=False, loop=None,
+                 profile_startup=False):
         self.dcss_task = None
         self.discord_task = None
-        self.loop = asyncio.get_event_loop()
+        self.metrics_task = None
         self.shutdown_error = False
 
+        self.startup_profile = None
+        if profile_startup:
+            self.startup_profile = StartupProfile(_start_time)
+            self.startup_profile.mark("imports")
+
         self.conf = CerebotConfig(config_file)
 
         try:
@@ -52,9 +77,26 @@ class Cerebot:
             self.critical_error("App Error loading config file {}:".format(
                 self.conf.path))
 
+        if self.startup_profile:
+            self.startup_profile.mark("config")
+
+        if loop:
+            self.loop = loop
+        else:
+            self.loop = new_event_loop(use_uvloop
+                                       or self.conf.get("use_uvloop"))
+        _log.info("Using event loop %s", type(self.loop).__name__)
+
         self.dcss_manager = DCSSManager(self.conf.dcss)
         self.discord_manager = None
 
+        self.snapshot = None
+        if self.conf.discord.get("snapshot_file"):
+            self.load_snapshot()
+
+        if self.startup_profile:
+            self.watch_irc_connect()
+
     def critical_error(self, error_msg):
         exc_type, exc_value, exc_tb = sys.exc_info()
         _log.critical("App Error: %s", error_msg)
@@ -101,17 +143,86 @@ class Cerebot:
         _log.info("Stopping bot.")
         self.shutdown_error = is_error
 
+        if self.metrics_task and not self.metrics_task.done():
+            self.metrics_task.cancel()
+
         if self.dcss_task and not self.dcss_task.done():
             self.dcss_task.cancel()
 
         if self.discord_task and not self.discord_task.done():
-            ensure_future(self.discord_manager.disconnect(True))
+            asyncio.ensure_future(self.discord_manager.disconnect(True))
+
+    def load_snapshot(self):
+        """Open the snapshot written when the bot last shut down. Its contents
+        are decoded when the first Discord manager is ready."""
+
+        path = self.conf.discord["snapshot_file"]
+        start = time.perf_counter()
+        self.snapshot = load_snapshot(path, self.conf.discord.get(
+            "snapshot_max_age", 3600))
+        if self.snapshot:
+            _log.info("App: Loaded snapshot file %s (%s bytes, %.0f seconds "
+                      "old) in %.1f ms", path, self.snapshot.size,
+                      self.snapshot.age, (time.perf_counter() - start) * 1000)
+
+        if self.startup_profile:
+            self.startup_profile.mark("snapshot")
+
+    def watch_irc_connect(self):
+        """Wrap the event loop's create_connection() so the startup profile
+        records when the connection to the IRC server is made."""
+
+        create_connection = self.loop.create_connection
+        hostname = self.conf.dcss.get("hostname")
+        profile = self.startup_profile
+
+        async def profiled_create_connection(*args, **kwargs):
+            result = await create_connection(*args, **kwargs)
+            host = args[1] if len(args) > 1 else kwargs.get("host")
+            if host == hostname:
+                profile.mark("IRC connect")
+            return result
+
+        try:
+            self.loop.create_connection = profiled_create_connection
+
+        except AttributeError:
+            _log.warning("App: Can't profile the IRC connection with event "
+                         "loop %s", type(self.loop).__name__)
 
-    @asyncio.coroutine
-    def process(self):
+    def new_discord_manager(self):
+        """Create the Discord manager used for each new connection."""
+
+        # Imported here so that the IRC connection can start before the
+        # Discord library and the command handlers are loaded.
+        from .discord import DiscordManager
+
+        profile = self.startup_profile
+        if profile and not profile.finished:
+            profile.mark("Discord import")
+
+        manager = DiscordManager(self.conf.discord, self.dcss_manager)
+        # Only the first manager is restored, since later ones replace a
+        # manager whose state is more recent.
+        manager.snapshot = self.snapshot
+        self.snapshot = None
+        if profile and not profile.finished:
+            manager.startup_profile = profile
+
+        return manager
+
+    async def process(self):
 
         # This task is never restarted.
-        self.dcss_task = ensure_future(self.dcss_manager.start())
+        self.dcss_task = asyncio.ensure_future(self.dcss_manager.start())
+        # Let the DCSS manager begin connecting before we do the slower
+        # Discord setup.
+        await asyncio.sleep(0)
+
+        if self.conf.get("metrics_file"):
+            self.metrics_task = asyncio.ensure_future(metrics.export(
+                self.conf["metrics_file"], self.conf.get("metrics_interval",
+                                                         15)))
 
         while True:
 
@@ -119,20 +230,20 @@ class Cerebot:
             if not self.discord_manager or not self.discord_manager.shutdown:
                 # Let the current task finish.
                 if self.discord_task and not self.discord_task.done():
-                    yield from self.discord_task
+                    await self.discord_task
 
                 # We re-instantiate the manager and create a new websocket.
-                self.discord_manager = DiscordManager(self.conf.discord,
-                                                      self.dcss_manager)
-                self.discord_task = ensure_future(self.discord_manager.start())
+                self.discord_manager = self.new_discord_manager()
+                self.discord_task = asyncio.ensure_future(
+                        self.discord_manager.start())
 
-            yield from asyncio.wait([self.dcss_task, self.discord_task],
+            await asyncio.wait([self.dcss_task, self.discord_task],
                     return_when=asyncio.FIRST_COMPLETED)
 
             # We are shutting down the bot.
             if self.dcss_task.done():
                 if self.discord_task and not self.discord_task.done():
-                    yield from self.discord_task
+                    await self.discord_task
                 return
 
 def main():
@@ -141,8 +252,14 @@ def main():
     parser.add_argument("-c", dest="config_file", metavar="<toml-file>",
                         default=_DEFAULT_CONFIG_FILE,
                         help="bot config file.")
+    parser.add_argument("--uvloop", action="store_true",
+                        help="run on the uvloop event loop if it's "
+                        "installed.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each phase of startup takes.")
     parser.add_argument("--version", action="version", version=version)
     args = parser.parse_args()
 
-    bot = Cerebot(args.config_file)
+    bot = Cerebot(args.config_file, args.uvloop,
+                  profile_startup=args.profile_startup)
     bot.start()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""cerebot-bench: Measure how quickly the Discord message handling path of the
+bot processes a synthetic load of chat messages.
+
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from .app import new_event_loop
+from .fakes import (FakeDCSSManager, FakeDiscordManager, FakeMember,
+                    FakeMessage, FakeServer)
+from .version import version
+
+# Sample content for each kind of message the generator produces.
+_chat_samples = ["hi all", "anyone seen the new trunk build?",
+                 "that was a close one", "gg", "lol", "brb",
+                 "how do I get out of the Abyss?"]
+_relay_samples = ["??pan", "??orb of zot", "@?hydra", "*?orb of fire",
+                  "&lg * won", "&dump", ".echo hi", "%git HEAD",
+                  "%0.20?sigmund", "?/ring"]
+
+_default_bot_commands = ["listcommands", "listroles"]
+
+
+def make_conf():
+    """Build a discord config table suitable for the fake manager. The rate
+    limits are raised so that they don't throttle the benchmark."""
+
+    return {
+        "token" : "bench",
+        "command_limit" : 10 ** 9,
+        "command_period" : 1,
+        "help_text" : "Benchmark bot.",
+        "admins" : [],
+    }
+
+
+def generate_messages(manager, args, tag_queries=False):
+    """Pre-generate the message stream so its construction isn't timed. Returns
+    a list of (channel, author, content) tuples. If `tag_queries` is true, each
+    relay query gets a unique ' q<number>' suffix so replies can be matched to
+    it."""
+
+    rand = random.Random(args.seed)
+    channels = []
+    authors = {}
+    for s in manager.servers:
+        members = [m for m in s.members if not m.bot]
+        for c in s.channels:
+            channels.append(c)
+            authors[c.id] = members
+
+    bot_commands = args.bot_commands.split(",")
+    messages = []
+    for n in range(args.messages):
+        channel = rand.choice(channels)
+        author = rand.choice(authors[channel.id])
+        if rand.random() < args.command_ratio:
+            if rand.random() < args.relay_share:
+                content = rand.choice(_relay_samples)
+                if tag_queries:
+                    content += " q{}".format(n)
+            else:
+                content = "!" + rand.choice(bot_commands)
+        else:
+            content = rand.choice(_chat_samples)
+
+        messages.append((channel, author, content))
+
+    return messages
+
+
+def make_managers(args):
+    dcss_manager = FakeDCSSManager(args.relay_latency, args.relay_lines)
+    conf = make_conf()
+    # The synthetic load repeats a few commands far more often than real chat
+    # does, so most replies would be skipped as duplicates. Replies are sent
+    # at once so that the run doesn't end waiting for them.
+    conf["duplicate_window"] = 0
+    conf["reply_flush_delay"] = 0
+    manager = FakeDiscordManager(conf, dcss_manager,
+                                 server_count=args.servers,
+                                 channel_count=args.channels,
+                                 member_count=args.members,
+                                 send_latency=args.send_latency)
+    return manager, dcss_manager
+
+
+async def drive(manager, dcss_manager, messages, concurrency):
+    """Feed every message through on_message with at most `concurrency`
+    handlers in flight, as the discord.py dispatcher would schedule them.
+    Returns a list of per-message handling latencies in seconds."""
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(message):
+        try:
+            start = time.perf_counter()
+            await manager.on_message(message)
+            latencies.append(time.perf_counter() - start)
+        finally:
+            semaphore.release()
+
+    tasks = []
+    for channel, author, content in messages:
+        await semaphore.acquire()
+        tasks.append(asyncio.ensure_future(handle(FakeMessage(channel, author,
+                                                              content))))
+
+    await asyncio.wait(tasks)
+    if dcss_manager.reply_tasks:
+        await asyncio.wait(list(dcss_manager.reply_tasks))
+    if manager.reply_flushes:
+        await asyncio.wait(list(manager.reply_flushes))
+
+    return latencies
+
+
+class NullManager:
+    """Stands in for both managers in drive() to measure the event loop's own
+    cost of dispatching a message handler."""
+
+    reply_tasks = ()
+    reply_flushes = ()
+
+    async def on_message(self, message):
+        return
+
+
+def measure_dispatch(loop, args):
+    """Return the mean seconds per message spent scheduling and running a
+    handler that does nothing."""
+
+    null = NullManager()
+    server = FakeServer("dispatch", FakeMember(None, "Cerebot", bot=True), 1)
+    messages = [(server.channels[0], server.me, "")] * args.messages
+
+    start = time.perf_counter()
+    loop.run_until_complete(drive(null, null, messages, args.concurrency))
+    return (time.perf_counter() - start) / args.messages
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_pass(loop, args, trace_allocations=False):
+    manager, dcss_manager = make_managers(args)
+    messages = generate_messages(manager, args)
+
+    # Warm up caches and code paths with a copy of the stream's first part.
+    warmup = messages[:args.warmup]
+    loop.run_until_complete(drive(manager, dcss_manager, warmup,
+                                  args.concurrency))
+
+    sends_before = len(manager.sent_messages)
+    queries_before = dcss_manager.queries
+    gc.collect()
+    if trace_allocations:
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+
+    start = time.perf_counter()
+    latencies = loop.run_until_complete(drive(manager, dcss_manager, messages,
+                                              args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "elapsed" : elapsed,
+        "latencies" : latencies,
+        "sends" : len(manager.sent_messages) - sends_before,
+        "relay_queries" : dcss_manager.queries - queries_before,
+    }
+    if trace_allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["alloc_peak_bytes"] = peak
+        result["alloc_retained_bytes"] = current
+        result["alloc_retained_blocks"] = (sys.getallocatedblocks()
+                                           - blocks_before)
+
+    return result
+
+
+def run_benchmark(args):
+    loop = new_event_loop(args.loop == "uvloop")
+
+    dispatch = measure_dispatch(loop, args)
+    timing = run_pass(loop, args)
+    allocs = run_pass(loop, args, trace_allocations=True)
+    loop.close()
+    latencies = timing["latencies"]
+    count = len(latencies)
+
+    return {
+        "version" : version,
+        "python" : platform.python_version(),
+        "params" : {
+            "loop" : args.loop,
+            "messages" : args.messages,
+            "servers" : args.servers,
+            "channels" : args.channels,
+            "members" : args.members,
+            "command_ratio" : args.command_ratio,
+            "relay_share" : args.relay_share,
+            "bot_commands" : args.bot_commands,
+            "concurrency" : args.concurrency,
+            "send_latency" : args.send_latency,
+            "relay_latency" : args.relay_latency,
+            "relay_lines" : args.relay_lines,
+            "seed" : args.seed,
+        },
+        "results" : {
+            "messages_per_sec" : count / timing["elapsed"],
+            "dispatch_overhead_us" : dispatch * 1e6,
+            "latency_mean_us" : sum(latencies) / count * 1e6,
+            "latency_p50_us" : percentile(latencies, 50) * 1e6,
+            "latency_p99_us" : percentile(latencies, 99) * 1e6,
+            "latency_max_us" : max(latencies) * 1e6,
+            "sends" : timing["sends"],
+            "relay_queries" : timing["relay_queries"],
+            "alloc_peak_kib" : allocs["alloc_peak_bytes"] / 1024,
+            "alloc_retained_bytes_per_msg" : (allocs["alloc_retained_bytes"]
+                                              / count),
+            "alloc_retained_blocks" : allocs["alloc_retained_blocks"],
+        },
+    }
+
+
+def print_report(report, baseline=None):
+    print("cerebot {} on Python {}".format(report["version"],
+                                           report["python"]))
+    print("params: {}".format(", ".join("{}={}".format(k, v) for k, v in
+                                        sorted(report["params"].items()))))
+
+    if baseline and baseline["params"] != report["params"]:
+        print("warning: baseline was run with different params")
+
+    for key, value in sorted(report["results"].items()):
+        line = "  {:32} {:14.2f}".format(key, value)
+        if baseline and key in baseline["results"]:
+            old = baseline["results"][key]
+            if old:
+                line += "  ({:+.1f}%)".format((value - old) / old * 100)
+        print(line)
+
+
+def add_load_arguments(parser):
+    """Arguments describing the synthetic load, shared with the other
+    benchmark tools."""
+
+    parser.add_argument("--loop", choices=["asyncio", "uvloop"],
+                        default="asyncio",
+                        help="event loop to run on (default: %(default)s).")
+    parser.add_argument("--messages", type=int, default=5000,
+                        help="number of messages to send (default: "
+                        "%(default)s).")
+    parser.add_argument("--servers", type=int, default=2,
+                        help="number of fake servers (default: %(default)s).")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="text channels per server (default: "
+                        "%(default)s).")
+    parser.add_argument("--members", type=int, default=50,
+                        help="members per server (default: %(default)s).")
+    parser.add_argument("--command-ratio", type=float, default=0.4,
+                        help="fraction of messages that are commands "
+                        "(default: %(default)s).")
+    parser.add_argument("--relay-share", type=float, default=0.75,
+                        help="fraction of commands that are DCSS relay "
+                        "queries rather than bot commands (default: "
+                        "%(default)s).")
+    parser.add_argument("--bot-commands", default=",".join(
+                        _default_bot_commands), metavar="<cmd,...>",
+                        help="bot commands to draw from (default: "
+                        "%(default)s).")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="maximum messages handled at once (default: "
+                        "%(default)s).")
+    parser.add_argument("--send-latency", type=float, default=0,
+                        help="simulated Discord API latency in seconds "
+                        "(default: %(default)s).")
+    parser.add_argument("--relay-latency", type=float, default=0,
+                        help="simulated knowledge bot latency in seconds "
+                        "(default: %(default)s).")
+    parser.add_argument("--relay-lines", type=int, default=1,
+                        help="lines in each relay reply (default: "
+                        "%(default)s).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for the message stream (default: "
+                        "%(default)s).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_load_arguments(parser)
+    parser.add_argument("--warmup", type=int, default=200,
+                        help="untimed messages sent first (default: "
+                        "%(default)s).")
+    parser.add_argument("--json", dest="json_file", metavar="<file>",
+                        help="write the report as JSON to this file.")
+    parser.add_argument("--compare", metavar="<file>",
+                        help="show changes relative to a JSON report from a "
+                        "previous run.")
+    parser.add_argument("--version", action="version", version=version)
+    args = parser.parse_args()
+
+    # The bot's own logging would dominate the measurements.
+    logging.basicConfig(level=logging.CRITICAL)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(args)
+    print_report(report, baseline)
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
@@ -1,23 +1,34 @@
 """Creating and managing the Discord connection."""
 
 import asyncio
-if hasattr(asyncio, "async"):
-    ensure_future = asyncio.async
-else:
-    ensure_future = asyncio.ensure_future
-
+import collections
 import discord
+import functools
 import logging
-import os
 import random
 import re
-import signal
 import sys
 import time
 import traceback
 
+import beem.chat
 from beem.chat import ChatWatcher, BotCommandException, bot_help_command
 
+from .admission import (ADMIN_MESSAGE, ADMIT, COSMETIC_COMMAND, DEFER, DROP,
+                        REJECT, RELAY_QUERY, AdmissionController)
+from . import heap
+from .gateway import GatewayWebSocket, run_gateway, use_zlib_stream
+from .health import ConnectionMonitor
+from .journal import (OUTCOME_DEFERRED, OUTCOME_DROPPED, OUTCOME_ERROR,
+                      OUTCOME_OK, OUTCOME_REJECTED, CommandJournal,
+                      CommandLogFilter, format_entry)
+from .metrics import metrics
+from .names import NameIndex
+from .paging import PageCache, paginate
+from .replies import RecentReplies
+from .roles import StreamingRoleReconciler, find_streaming_role, is_streaming
+from .scheduler import FairScheduler
+from .snapshot import write_snapshot
 from .version import version as Version
 
 _log = logging.getLogger()
@@ -29,11 +40,57 @@ _url_regexp = (r'(https?://(?:\S+(?::\S*)?@)?(?:(?:[1-9]\d?|1\d\d|2[01]\d|22'
                r'[a-z\u00a1-\uffff0-9]+)(?:\.(?:[a-z\u00a1-\uffff0-9]+-?)*'
                r'[a-z\u00a1-\uffff0-9]+)*(?:\.(?:[a-z\u00a1-\uffff]{2,})))'
                r'(?::\d{2,5})?(?:/[^\s]*)?)')
+_url_pattern = re.compile(_url_regexp)
+# Used to find mentions in discord messages.
+_mention_pattern = re.compile(r'(<@&?[0-9]+>)')
 
 # How long we allow inactivity in a channel before we remove its channel source
 # object from the cache.
 _channel_idle_timeout = 30 * 60
 
+# How many candidates to list when a name is ambiguous.
+_max_name_candidates = 5
+
+# Journal outcomes of messages not admitted due to load.
+_shed_outcomes = {DROP : OUTCOME_DROPPED, DEFER : OUTCOME_DEFERRED,
+                  REJECT : OUTCOME_REJECTED}
+
+# Scheduling cost of each kind of command, relative to the default of 1.
+# Cosmetic commands hold a handler for seconds while they animate.
+_command_costs = {COSMETIC_COMMAND : 4}
+
+# The default and largest number of entries shown by !journal.
+_journal_tail_default = 10
+_journal_tail_max = 50
+
+# How many allocation sites the heap commands report.
+_heap_report_sites = 10
+
+# Chat output longer than this many characters is split into pages.
+_default_page_size = 800
+
+# Discord's limit on the length of a message, and the most pages the note
+# about remaining pages is allowed room for.
+_max_message_length = 2000
+_max_note_pages = 99999
+
+# Chat output sent to a channel within this many seconds is joined into one
+# reply.
+_default_reply_flush_delay = 0.3
+
+# A reply repeating one sent to the same channel within this many seconds
+# isn't sent again, and the original gets this reaction instead.
+_default_duplicate_window = 5
+_default_duplicate_reaction = "\U0001F501"
+
+metrics.describe("discord_paged_replies_total",
+                 "Replies split into pages, with only the first page sent.")
+metrics.describe("discord_more_pages_total",
+                 "Held pages sent by the !more command.")
+metrics.describe("discord_duplicate_replies_total",
+                 "Replies not sent because they repeat a recent reply in the "
+                 "same channel, by whether the original got a reaction.")
+
 
 class DiscordSource(ChatWatcher):
     """The channel source object that handles chat for any kind of discord
@@ -51,6 +108,14 @@ class DiscordSource(ChatWatcher):
         # Time since any message was last seen in the channel, used for the
         # Discord manager cache of these objects.
         self.time_last_message = None
+        # Output waiting to be sent together, as (message type, message)
+        # tuples, and the task that will send it.
+        self.pending_replies = []
+        self.reply_flush = None
+        # When each relay query was last sent from this channel, and when
+        # queries repeating one still in the duplicate window were sent.
+        self.recent_queries = {}
+        self.repeated_queries = collections.deque()
 
     # Set to the bot only if we're in PM, otherwise None.
     @property
@@ -94,12 +159,11 @@ class DiscordSource(ChatWatcher):
     def get_user_by_name(self, name):
         is_id = name.isdigit()
         if self.channel.is_private:
-            for s in self.manager.servers:
-                if is_id:
-                    member = s.get_member(name)
-                else:
-                    member = s.get_member_named(name)
+            if not is_id:
+                return self.manager.find_member(name)
 
+            for s in self.manager.servers:
+                member = s.get_member(name)
                 if member:
                     return member
 
@@ -118,6 +182,16 @@ class DiscordSource(ChatWatcher):
             return
 
         server = self.channel.server
+        cache = self.manager.vanity_roles_cache
+        if server.id not in cache:
+            cache[server.id] = self.find_vanity_roles(server)
+
+        return cache[server.id]
+
+    def find_vanity_roles(self, server):
+        """Scan the roles of the given server for vanity roles. Returns None if
+        the bot has no "Bot" role there."""
+
         bot_role = None
         for r in server.roles:
             if r.name == "Bot" and r in server.me.roles:
@@ -147,7 +221,7 @@ class DiscordSource(ChatWatcher):
         """Escape most markdown from message output, being careful not to
         mangle any URLs and allowing backticks to remain."""
 
-        parts = re.split(_url_regexp, message)
+        parts = _url_pattern.split(message)
         result = ""
         for i, p in enumerate(parts):
             # URLs parts will always be at an odd index. These are
@@ -163,7 +237,7 @@ class DiscordSource(ChatWatcher):
         """Don't output anything that would be a mention, since people can
         abuse this to have the bot say them."""
 
-        parts = re.split(r'(<@&?[0-9]+>)', message)
+        parts = _mention_pattern.split(message)
         result = ""
         for i, p in enumerate(parts):
             # The mentions will be at an even index.
@@ -183,9 +257,9 @@ class DiscordSource(ChatWatcher):
             raise BotCommandException(
                     "This command must be run in a public channel.")
 
-    @asyncio.coroutine
-    def send_chat(self, message, message_type="normal"):
-        """Clean up message output before sending it to chat."""
+    def format_chat(self, message, message_type="normal"):
+        """Clean up message output and apply the formatting of its message
+        type."""
 
         # Clean up any markdown we don't want.
         if message_type == "monster":
@@ -203,7 +277,190 @@ class DiscordSource(ChatWatcher):
         elif self.message_needs_escape(message):
             message = "]" + message
 
-        yield from self.manager.send_message(self.channel, message)
+        return message
+
+    async def send_chat(self, message, message_type="normal"):
+        """Queue message output to be sent to chat. Relay replies arrive one
+        IRC line at a time, so output sent within reply_flush_delay seconds
+        is joined and sent as one reply, which can then be paged."""
+
+        delay = self.manager.conf.get("reply_flush_delay",
+                                      _default_reply_flush_delay)
+        if not delay:
+            await self.send_reply(message, message_type)
+            return
+
+        self.pending_replies.append((message_type, message))
+        if not self.reply_flush:
+            self.reply_flush = asyncio.ensure_future(
+                self.flush_replies(delay))
+            self.manager.reply_flushes.add(self.reply_flush)
+            self.reply_flush.add_done_callback(
+                self.manager.reply_flushes.discard)
+
+    async def flush_replies(self, delay):
+        """Send the queued output after `delay` seconds, joining consecutive
+        lines of the same message type."""
+
+        await asyncio.sleep(delay)
+        pending = self.pending_replies
+        self.pending_replies = []
+        self.reply_flush = None
+
+        if self.repeated_queries:
+            pending = self.collapse_repeats(pending)
+
+        replies = []
+        for message_type, message in pending:
+            if replies and replies[-1][0] == message_type:
+                replies[-1][1].append(message)
+            else:
+                replies.append((message_type, [message]))
+
+        for message_type, lines in replies:
+            try:
+                await self.send_reply("\n".join(lines), message_type)
+
+            except Exception:
+                self.manager.log_exception("Unable to send reply")
+
+    def note_relay_query(self, query):
+        """Note a relay query sent from this channel, for collapse_repeats()."""
+
+        now = time.monotonic()
+        cutoff = now - self.manager.recent_replies.window
+        for q, t in list(self.recent_queries.items()):
+            if t < cutoff:
+                del self.recent_queries[q]
+
+        if query in self.recent_queries:
+            self.repeated_queries.append(now)
+        self.recent_queries[query] = now
+
+    def collapse_repeats(self, pending):
+        """Return the queued output with repeated replies to repeated queries
+        removed. The replies of identical queries can be queued together, and
+        lines can't be matched to replies, so queued output is only collapsed
+        when it's wholly made of as many identical runs of lines as there
+        were identical queries. Lines are never dropped from within one
+        reply."""
+
+        cutoff = time.monotonic() - self.manager.recent_replies.window
+        while self.repeated_queries and self.repeated_queries[0] < cutoff:
+            self.repeated_queries.popleft()
+
+        for copies in range(len(self.repeated_queries) + 1, 1, -1):
+            if len(pending) % copies:
+                continue
+
+            size = len(pending) // copies
+            run = pending[:size]
+            if all(pending[i:i + size] == run
+                   for i in range(size, len(pending), size)):
+                metrics.inc("discord_duplicate_replies_total", copies - 1,
+                            action="skipped")
+                for i in range(copies - 1):
+                    self.repeated_queries.popleft()
+                return run
+
+        return pending
+
+    async def send_reply(self, message, message_type):
+        """Clean up message output and send it. Long output is split into
+        pages, and only the first is sent. The rest are held for the !more
+        command. Output that exactly repeats a recent reply in this channel
+        isn't sent."""
+
+        recent_replies = self.manager.recent_replies
+        if recent_replies:
+            key = hash((message_type, message))
+            reply = recent_replies.find(self.channel.id, key)
+            if reply:
+                await self.collapse_duplicate(reply)
+                return
+
+            reply = recent_replies.add(self.channel.id, key)
+
+        pages = self.split_pages(message, message_type)
+        if len(pages) > 1:
+            self.manager.page_cache.store(self.channel.id, pages[1:],
+                                          message_type)
+            metrics.inc("discord_paged_replies_total")
+
+        sent = None
+        try:
+            sent = await self.send_page(pages[0], message_type,
+                                        len(pages) - 1)
+
+        finally:
+            # A reply that failed to send mustn't stop a retry.
+            if recent_replies:
+                if sent:
+                    reply.message = sent
+                else:
+                    recent_replies.remove(self.channel.id, key, reply)
+
+    async def collapse_duplicate(self, reply):
+        """React to the original of a duplicate reply, unless it's still
+        being sent or already has the reaction."""
+
+        reaction = self.manager.conf.get("duplicate_reaction",
+                                         _default_duplicate_reaction)
+        if not reaction or not reply.message or reply.reacted:
+            metrics.inc("discord_duplicate_replies_total", action="skipped")
+            return
+
+        reply.reacted = True
+        metrics.inc("discord_duplicate_replies_total", action="reacted")
+        try:
+            await self.manager.add_reaction(reply.message, reaction)
+
+        except discord.HTTPException:
+            self.manager.log_exception("Unable to react to duplicate reply")
+
+    def more_note(self, pages_left):
+        return "\n({} more {}, type `{}more`)".format(
+            pages_left, "page" if pages_left == 1 else "pages",
+            self.bot_command_prefix)
+
+    def split_pages(self, message, message_type):
+        """Split output into pages of at most page_size characters. Whatever
+        the page size, each page fits in one Discord message once formatted
+        and given the note about remaining pages."""
+
+        limit = _max_message_length - len(self.more_note(_max_note_pages))
+        size = self.manager.conf.get("page_size", _default_page_size)
+        size = min(size, limit) if size else limit
+        pages = []
+        for page in paginate(message, size):
+            pages.extend(self.fit_page(page, message_type, limit))
+
+        return pages
+
+    def fit_page(self, page, message_type, limit):
+        """Split a page further until each part is at most `limit` characters
+        once formatted, since escaping and code blocks add to its length."""
+
+        length = len(self.format_chat(page, message_type))
+        if length <= limit or len(page) <= 1:
+            return [page]
+
+        pages = []
+        for part in paginate(page, max(1, len(page) * limit // length)):
+            pages.extend(self.fit_page(part, message_type, limit))
+
+        return pages
+
+    async def send_page(self, message, message_type, pages_left=0):
+        message = self.format_chat(message, message_type)
+        if pages_left:
+            message += self.more_note(pages_left)
+
+        if self.manager.recorder:
+            self.manager.recorder.record_reply(self.channel, message,
+                                               message_type)
+
+        return await self.manager.send_message(self.channel, message)
 
 
 class DiscordManager(discord.Client):
@@ -218,10 +475,73 @@ class DiscordManager(discord.Client):
         self.bot_commands = bot_commands
 
         self.single_user = False
-        self.ping_task = None
+        self.health_monitor = ConnectionMonitor(self, conf)
+        self.health_task = None
+        self.admission = AdmissionController(self, conf)
+        self.admission_task = None
+        self.role_reconciler = StreamingRoleReconciler(self, conf)
+        self.scheduler = FairScheduler(conf)
+        # Message sends and edits that haven't completed.
+        self.outbound_pending = 0
         self.shutdown = False
         self.sources = set()
 
+        # The !listcommands output, keyed by whether the user is an admin and
+        # whether the channel is private, since these decide which commands
+        # are available.
+        self.command_list_cache = {}
+        # Vanity roles of each server, keyed by server ID.
+        self.vanity_roles_cache = {}
+        # Pages of long output not yet sent, for !more.
+        self.page_cache = PageCache(conf.get("page_cache_size", 100),
+                                    conf.get("page_ttl", 300))
+        # Tasks sending queued chat output.
+        self.reply_flushes = set()
+        # Hashes of recent replies in each channel, for skipping duplicates.
+        self.recent_replies = None
+        duplicate_window = conf.get("duplicate_window",
+                                    _default_duplicate_window)
+        if duplicate_window:
+            self.recent_replies = RecentReplies(duplicate_window)
+
+        # Name indexes of servers, of the text channels of each server keyed
+        # by server ID, and of members of all servers. These are built on
+        # first use and then kept current from Discord events. The member
+        # index is built separately, since it can be large and only direct
+        # messages need it.
+        self.server_indexes_built = False
+        self.server_index = NameIndex()
+        self.channel_indexes = {}
+        self.member_index_built = False
+        self.member_index = NameIndex()
+
+        self.recorder = None
+        if self.conf.get("record_file"):
+            from .traffic import TrafficRecorder
+            self.recorder = TrafficRecorder(self.conf["record_file"])
+
+        self.gateway_record = None
+        if self.conf.get("gateway_record_file"):
+            self.gateway_record = open(self.conf["gateway_record_file"], "ab")
+
+        self.gateway_websocket = self.configure_gateway()
+
+        self.journal = None
+        self.command_log_filter = None
+        if self.conf.get("journal_file"):
+            self.journal = CommandJournal(self.conf["journal_file"],
+                                          self.conf.get("journal_entries",
+                                                        65536))
+            # The journal replaces beem's per-command log lines, which go to
+            # the root logger.
+            self.command_log_filter = CommandLogFilter(beem.chat.__file__)
+            logging.getLogger().addFilter(self.command_log_filter)
+
+        # Set by the app when it wants to know when we're first ready.
+        self.startup_profile = None
+        # Set by the app to a snapshot to restore once we're ready.
+        self.snapshot = None
+
         self.dcss_manager = dcss_manager
         dcss_manager.managers["Discord"] = self
 
@@ -233,27 +553,72 @@ class DiscordManager(discord.Client):
         _log.error("".join(traceback.format_exception(
             exc_type, exc_value, exc_tb)))
 
-    @asyncio.coroutine
-    def start_ping(self):
-        """Start a repeating 10 second ping task to help connection
-        stability."""
+    def configure_gateway(self):
+        """Return the websocket class to connect to the gateway with."""
+
+        zlib_stream = self.conf.get("gateway_zlib_stream", True)
+        # Typing events are never used. Presence updates are also the only
+        # events that carry username changes, so they're only dropped when
+        # asked for, and never when the streaming role needs them.
+        drop_events = []
+        if self.conf.get("gateway_drop_events", True):
+            drop_events.append("TYPING_START")
+        if (self.conf.get("gateway_drop_presence")
+                and not self.conf.get("set_streaming_role")):
+            drop_events.append("PRESENCE_UPDATE")
+
+        return GatewayWebSocket.configure(
+            zlib_stream=zlib_stream,
+            json_backend=self.conf.get("gateway_json_backend", "auto"),
+            drop_events=drop_events,
+            record_file=self.gateway_record)
+
+    async def connect(self):
+        """Connect to the gateway with our websocket class, processing events
+        until disconnected."""
+
+        if self.gateway_websocket.zlib_stream:
+            use_zlib_stream(self.http)
+
+        await run_gateway(self, self.gateway_websocket)
+
+    async def resume_connection(self, reason):
+        """Close the gateway websocket with a code that makes discord.py
+        reconnect and resume the session, rather than starting a new one."""
+
+        _log.warning("Discord: Resuming gateway connection: %s", reason)
+        metrics.inc("discord_gateway_resumes_total")
+        try:
+            await self.ws.close(4000, reason)
 
-        while True:
-            if self.is_closed:
-                return
+        except Exception:
+            self.log_exception("Unable to close websocket for resume")
+            asyncio.ensure_future(self.disconnect())
 
-            try:
-                yield from self.ws.ping()
+    def handle_socket_raw_receive(self, msg):
+        """Called by the discord.py dispatcher for every frame received from
+        the gateway."""
 
-            except asyncio.CancelledError:
-                return
+        self.health_monitor.frame_received()
 
-            except Exception:
-                self.log_exception("Unable to send ping")
-                ensure_future(self.disconnect())
-                return
+    async def send_message(self, destination, content=None, *args,
+                           **kwargs):
+        self.outbound_pending += 1
+        try:
+            return await super().send_message(destination, content, *args,
+                                              **kwargs)
+
+        finally:
+            self.outbound_pending -= 1
+
+    async def edit_message(self, message, new_content=None, *args, **kwargs):
+        self.outbound_pending += 1
+        try:
+            return await super().edit_message(message, new_content, *args,
+                                              **kwargs)
 
-            yield from asyncio.sleep(10)
+        finally:
+            self.outbound_pending -= 1
 
     def get_channel_source(self, channel):
         """Get the source object of the given discord channel object."""
@@ -272,8 +637,7 @@ class DiscordManager(discord.Client):
             if current_time - c.time_last_message >= _channel_idle_timeout:
                 self.sources.remove(c)
 
-    @asyncio.coroutine
-    def on_message(self, message):
+    async def on_message(self, message):
         """Handle a Discord chat message."""
 
         if not self.is_logged_in:
@@ -281,6 +645,9 @@ class DiscordManager(discord.Client):
 
         current_time = time.time()
         self.expire_idle_channels(current_time)
+        self.page_cache.expire()
+        if self.recent_replies:
+            self.recent_replies.expire()
 
         source = self.get_channel_source(message.channel)
         if not source:
@@ -294,40 +661,375 @@ class DiscordManager(discord.Client):
         if content.startswith("*?"):
             content = '@' + content[1:]
 
-        yield from source.read_chat(message.author, content)
+        kind = self.admission.classify(source, message.author, content)
+        if self.recorder:
+            self.recorder.record_message(message.channel, message.author,
+                                         content, kind is not None)
+
+        action = await self.admission.admit(source, message.author, content,
+                                            kind)
+        if action != ADMIT:
+            if self.journal and kind:
+                self.journal.record(message.channel, message.author,
+                                    self.journal_command_name(source, content),
+                                    _shed_outcomes[action])
+            return
+
+        await self.run_chat(source, message.author, content, kind)
+
+    async def run_chat(self, source, user, content, kind):
+        """Handle an admitted chat message of the kind returned by
+        AdmissionController.classify(), journaling commands and relay
+        queries."""
+
+        if not self.journal or not kind:
+            await self.handle_chat(source, user, content, kind)
+            return
+
+        command = self.journal_command_name(source, content)
+        start = time.perf_counter()
+        outcome = OUTCOME_ERROR
+        try:
+            await self.handle_chat(source, user, content, kind)
+            outcome = OUTCOME_OK
+
+        finally:
+            self.journal.record(source.channel, user, command, outcome,
+                                time.perf_counter() - start)
+
+    async def handle_chat(self, source, user, content, kind):
+        """Pass a chat message to its source. Commands and relay queries are
+        queued on the fair scheduler by server, except for admin messages,
+        which are handled at once."""
+
+        if kind == RELAY_QUERY and self.recent_replies:
+            source.note_relay_query(content)
+
+        if not kind or kind == ADMIN_MESSAGE:
+            await source.read_chat(user, content)
+            return
+
+        channel = source.channel
+        key = "private" if channel.is_private else channel.server.id
+        await self.scheduler.run(key, _command_costs.get(kind, 1),
+                                 functools.partial(source.read_chat, user,
+                                                   content))
+
+    def journal_command_name(self, source, content):
+        """Return the name a command or relay query is journaled under: the
+        bot command with its prefix, or the first word of the query."""
+
+        prefix = source.bot_command_prefix
+        if content.startswith(prefix):
+            words = content[len(prefix):].split(None, 1)
+            if words and words[0] in self.bot_commands:
+                return prefix + words[0]
 
-    @asyncio.coroutine
-    def on_ready(self):
+        words = content.split(None, 1)
+        return words[0] if words else content
+
+    async def on_ready(self):
         """Handle anything that needs to be done only after Discord is fully
-        connected and ready. Currently only needed by the ping task."""
+        connected and ready."""
 
-        self.ping_task = ensure_future(self.start_ping())
+        if self.snapshot:
+            self.restore_snapshot()
 
-    @asyncio.coroutine
-    def on_member_update(self, before, after):
-        """Handle Discord member state changes. Currently only used to set a
-        "streaming" role."""
+        if self.startup_profile:
+            self.startup_profile.mark("Discord ready")
+            self.startup_profile.finish()
 
-        if not self.conf.get("set_streaming_role"):
+        self.health_monitor.reset()
+        if not self.health_task or self.health_task.done():
+            self.health_task = asyncio.ensure_future(
+                    self.health_monitor.run())
+        if not self.admission_task or self.admission_task.done():
+            self.admission_task = asyncio.ensure_future(self.admission.run())
+
+        if self.conf.get("set_streaming_role"):
+            for s in self.servers:
+                self.role_reconciler.reconcile(s)
+
+    async def on_resumed(self):
+        self.health_monitor.reset()
+
+    def command_list_key(self):
+        """A key identifying the commands that the cached !listcommands output
+        was made from."""
+
+        return "{} {}".format(Version, " ".join(sorted(self.bot_commands)))
+
+    def save_snapshot(self):
+        """Write the channel sources and caches to the snapshot file."""
+
+        path = self.conf["snapshot_file"]
+        start = time.perf_counter()
+        sections = {
+            "sources" : [(s.channel.id, s.time_last_message)
+                         for s in self.sources],
+            "pages" : self.page_cache.dump(),
+            "command_list" : {
+                "key" : self.command_list_key(),
+                "entries" : [(is_admin, is_private, text)
+                             for (is_admin, is_private), text
+                             in self.command_list_cache.items()],
+            },
+        }
+        try:
+            size = write_snapshot(path, sections)
+
+        except OSError as e:
+            _log.error("Discord: Unable to write snapshot file %s: %s", path,
+                       e)
             return
 
-        streaming_role = None
-        for r in after.server.roles:
-            if r.name.lower() == "streaming":
-                streaming_role = r
-                break
+        _log.info("Discord: Wrote snapshot file %s (%s bytes) in %.1f ms",
+                  path, size, (time.perf_counter() - start) * 1000)
+
+    def restore_snapshot(self):
+        """Restore channel sources and caches from the snapshot set by the
+        app, discarding entries for channels that no longer exist or that
+        have expired."""
+
+        snapshot = self.snapshot
+        self.snapshot = None
+        start = time.perf_counter()
+        current_time = time.time()
+        restored = 0
+        discarded = 0
+
+        for channel_id, last_time in snapshot.section("sources", []):
+            channel = self.get_channel(channel_id)
+            if (not channel or self.get_channel_source(channel)
+                    or current_time - last_time >= _channel_idle_timeout):
+                discarded += 1
+                continue
+
+            source = DiscordSource(self, channel)
+            source.time_last_message = last_time
+            self.sources.add(source)
+            restored += 1
+
+        entries = snapshot.section("pages", [])
+        count = self.page_cache.load(e for e in entries
+                                     if self.get_channel(e[0]))
+        restored += count
+        discarded += len(entries) - count
+
+        command_list = snapshot.section("command_list", {})
+        entries = command_list.get("entries", [])
+        if command_list.get("key") == self.command_list_key():
+            for is_admin, is_private, text in entries:
+                self.command_list_cache[(is_admin, is_private)] = text
+            restored += len(entries)
+        else:
+            discarded += len(entries)
+
+        snapshot.close()
+        _log.info("Discord: Restored %s entries from snapshot and discarded "
+                  "%s in %.1f ms", restored, discarded,
+                  (time.perf_counter() - start) * 1000)
+
+    def invalidate_server_caches(self, server):
+        """Drop cached data derived from a server's roles and settings."""
+
+        self.vanity_roles_cache.pop(server.id, None)
+
+    def build_server_indexes(self):
+        """Index the names of all servers and their channels."""
+
+        self.server_index.clear()
+        self.channel_indexes = {}
+        for s in self.servers:
+            self.index_server(s)
+
+        self.server_indexes_built = True
+
+    def build_member_index(self):
+        """Index the names of the members of all servers."""
+
+        self.member_index.clear()
+        for s in self.servers:
+            self.index_server_members(s)
+
+        self.member_index_built = True
+
+    def index_server(self, server):
+        if server.unavailable:
+            return
 
+        self.server_index.add(server.id, server, server.name)
+        self.channel_indexes[server.id] = NameIndex()
+        for c in server.channels:
+            self.index_channel(c)
+
+    def index_server_members(self, server):
+        if server.unavailable:
+            return
+
+        for m in server.members:
+            self.index_member(m)
+
+    def unindex_server(self, server):
+        self.server_index.remove(server.id)
+        self.channel_indexes.pop(server.id, None)
+
+    def unindex_server_members(self, server):
+        for m in server.members:
+            self.member_index.remove((server.id, m.id))
+
+    def index_channel(self, channel):
+        if channel.is_private or channel.server.id not in self.channel_indexes:
+            return
+
+        index = self.channel_indexes[channel.server.id]
+        if channel.type == discord.ChannelType.text:
+            index.add(channel.id, channel, channel.name)
+        else:
+            index.remove(channel.id)
+
+    def unindex_channel(self, channel):
+        if channel.is_private or channel.server.id not in self.channel_indexes:
+            return
+
+        self.channel_indexes[channel.server.id].remove(channel.id)
+
+    def index_member(self, member):
+        # Members are looked up by name, nick, or name#discriminator, like
+        # Server.get_member_named().
+        self.member_index.add((member.server.id, member.id), member,
+                              member.name, member.nick, str(member))
+
+    def find_servers(self, name):
+        """Return a ranked list of (rank, name, server) matches for the given
+        server name."""
+
+        if not self.server_indexes_built:
+            self.build_server_indexes()
+
+        return self.server_index.search(name)
+
+    def find_channels(self, server, name):
+        """Return a ranked list of (rank, name, channel) matches for the given
+        text channel name on a server."""
+
+        if not self.server_indexes_built:
+            self.build_server_indexes()
+
+        index = self.channel_indexes.get(server.id)
+        if not index:
+            return []
+
+        return index.search(name)
+
+    def find_member(self, name):
+        """Find a member of any server with the given name, nick or
+        name#discriminator, preferring a case-sensitive match."""
+
+        if not self.member_index_built:
+            self.build_member_index()
+
+        matches = self.member_index.search(name, exact_only=True)
+        for rank, member_name, member in matches:
+            if name in (member.name, member.nick, str(member)):
+                return member
+
+        if matches:
+            return matches[0][2]
+
+        # Members of large servers can arrive after the index is built
+        # without a join event, so fall back to a scan for them.
+        for s in self.servers:
+            member = s.get_member_named(name)
+            if member:
+                self.index_member(member)
+                return member
+
+    async def on_server_join(self, server):
+        if self.server_indexes_built:
+            self.index_server(server)
+        if self.member_index_built:
+            self.index_server_members(server)
+
+        if self.conf.get("set_streaming_role"):
+            self.role_reconciler.reconcile(server)
+
+    async def on_server_available(self, server):
+        if self.server_indexes_built:
+            self.index_server(server)
+        if self.member_index_built:
+            self.index_server_members(server)
+
+        if self.conf.get("set_streaming_role"):
+            self.role_reconciler.reconcile(server)
+
+    async def on_server_update(self, before, after):
+        self.invalidate_server_caches(after)
+        if self.server_indexes_built and before.name != after.name:
+            self.server_index.add(after.id, after, after.name)
+
+    async def on_server_remove(self, server):
+        self.invalidate_server_caches(server)
+        if self.server_indexes_built:
+            self.unindex_server(server)
+        if self.member_index_built:
+            self.unindex_server_members(server)
+
+    async def on_channel_create(self, channel):
+        if self.server_indexes_built:
+            self.index_channel(channel)
+
+    async def on_channel_update(self, before, after):
+        if self.server_indexes_built:
+            self.index_channel(after)
+
+    async def on_channel_delete(self, channel):
+        if self.server_indexes_built:
+            self.unindex_channel(channel)
+
+    async def on_member_join(self, member):
+        if self.member_index_built:
+            self.index_member(member)
+
+    async def on_member_remove(self, member):
+        if self.member_index_built:
+            self.member_index.remove((member.server.id, member.id))
+
+    async def on_server_role_create(self, role):
+        self.invalidate_server_caches(role.server)
+
+    async def on_server_role_delete(self, role):
+        self.invalidate_server_caches(role.server)
+
+    async def on_server_role_update(self, before, after):
+        self.invalidate_server_caches(after.server)
+
+    async def on_member_update(self, before, after):
+        """Handle Discord member state changes. Used to notice changes to the
+        bot's own roles and to set a "streaming" role."""
+
+        # The bot's own roles decide which vanity roles it can hand out.
+        if after == after.server.me and before.roles != after.roles:
+            self.invalidate_server_caches(after.server)
+
+        if (self.member_index_built
+                and (before.name != after.name or before.nick != after.nick
+                     or before.discriminator != after.discriminator)):
+            self.index_member(after)
+
+        if not self.conf.get("set_streaming_role"):
+            return
+
+        streaming_role = find_streaming_role(after.server)
         if not streaming_role:
             return
 
-        if (after.game and after.game.type == 1
-                and streaming_role not in after.roles):
-            yield from self.add_roles(after, streaming_role)
+        if is_streaming(after) and streaming_role not in after.roles:
+            await self.add_roles(after, streaming_role)
             _log.info("Gave user %s on server %s streaming role", after,
                     after.server)
-        elif ((not after.game or after.game.type != 1)
-                and streaming_role in after.roles):
-            yield from self.remove_roles(after, streaming_role)
+        elif not is_streaming(after) and streaming_role in after.roles:
+            await self.remove_roles(after, streaming_role)
             _log.info("Removed streaming role for user %s on server %s", after,
                     after.server)
 
@@ -369,27 +1071,49 @@ class DiscordManager(discord.Client):
 
         return False
 
-    @asyncio.coroutine
-    def start(self):
+    async def start(self):
         """Set the discord login token an connect, processing discord events
         indefinitely."""
 
-        yield from self.login(self.conf['token'])
-        yield from self.connect()
+        try:
+            await self.login(self.conf['token'])
+            await self.connect()
+
+        finally:
+            if self.recorder:
+                self.recorder.close()
+
+            if self.journal:
+                self.journal.close()
+                logging.getLogger().removeFilter(self.command_log_filter)
 
-    @asyncio.coroutine
-    def disconnect(self, shutdown=False):
+            # Payloads are recorded until the connection is done with.
+            if self.gateway_record:
+                self.gateway_record.close()
+
+    async def disconnect(self, shutdown=False):
         """Disconnect from Discord. This will log any disconnection error, but
         never raise."""
 
-        if self.ping_task and not self.ping_task.done():
-            self.ping_task.cancel()
+        if self.health_task and not self.health_task.done():
+            self.health_task.cancel()
+
+        if self.admission_task and not self.admission_task.done():
+            self.admission_task.cancel()
+
+        self.role_reconciler.cancel()
+
+        if self.journal:
+            self.journal.close()
+
+        if shutdown and self.conf.get("snapshot_file"):
+            self.save_snapshot()
 
         if self.conf.get("fake_connect") or self.is_closed:
             return
 
         try:
-            yield from self.close()
+            await self.close()
 
         except Exception:
             self.log_exception("Error when disconnecting")
@@ -397,26 +1121,28 @@ class DiscordManager(discord.Client):
         self.shutdown = shutdown
 
 
-@asyncio.coroutine
-def bot_listcommands_command(source, user):
+async def bot_listcommands_command(source, user):
     """!listcommands chat command"""
 
-    commands = []
-    for com in bot_commands:
-        try:
-            source.check_bot_command_restrictions(user, bot_commands[com])
+    cache = source.manager.command_list_cache
+    key = (source.manager.user_is_admin(user), source.channel.is_private)
+    if key not in cache:
+        commands = []
+        for com in bot_commands:
+            try:
+                source.check_bot_command_restrictions(user, bot_commands[com])
 
-        except BotCommandException:
-            continue
+            except BotCommandException:
+                continue
+
+            commands.append(source.bot_command_prefix + com)
 
-        commands.append(source.bot_command_prefix + com)
+        commands.sort()
+        cache[key] = "Available commands: {}".format(', '.join(commands))
 
-    commands.sort()
-    yield from source.send_chat("Available commands: {}".format(
-        ', '.join(commands)))
+    await source.send_chat(cache[key])
 
-@asyncio.coroutine
-def bot_botstatus_command(source, user):
+async def bot_botstatus_command(source, user):
     """!botstatus chat command"""
 
     mgr = source.manager
@@ -429,15 +1155,14 @@ def bot_botstatus_command(source, user):
     names.sort()
     report = "Version: {}; Listening to servers: {}".format(Version,
             ", ".join(names))
-    yield from source.send_chat(report)
+    await source.send_chat(report)
 
-@asyncio.coroutine
-def bot_debugmode_command(source, user, state=None):
+async def bot_debugmode_command(source, user, state=None):
     """!debugmode chat command"""
 
     state_desc = "on" if _log.isEnabledFor(logging.DEBUG) else "off"
     if state is None:
-        yield from source.send_chat(
+        await source.send_chat(
                 "DEBUG level logging is currently {}.".format(state_desc))
         return
 
@@ -448,20 +1173,114 @@ def bot_debugmode_command(source, user, state=None):
     state_val = "DEBUG" if state == "on" else "INFO"
     _log.setLevel(state_val)
 
-    yield from source.send_chat("DEBUG level logging set to {}.".format(state))
+    await source.send_chat("DEBUG level logging set to {}.".format(state))
+
+async def bot_heaptrace_command(source, user, state=None):
+    """!heaptrace chat command"""
+
+    state_desc = "on" if heap.is_tracing() else "off"
+    if state is None:
+        await source.send_chat(
+                "Heap tracing is currently {}.".format(state_desc))
+        return
+
+    if state == state_desc:
+        raise BotCommandException("Heap tracing already set to {}".format(
+            state))
+
+    if state == "on":
+        heap.start_tracing()
+    else:
+        heap.stop_tracing()
+
+    await source.send_chat("Heap tracing set to {}.".format(state))
+
+def heap_report():
+    """Take a heap snapshot and return report lines for it and for object
+    counts. This can take seconds with a large heap."""
+
+    snapshot, previous = heap.take_snapshot()
+    if previous:
+        lines = heap.growth_sites(snapshot, previous, _heap_report_sites)
+    else:
+        lines = heap.top_sites(snapshot, _heap_report_sites)
+
+    lines.append(heap_object_counts())
+    return lines
+
+def heap_object_counts():
+    """A report line counting bot and discord.py objects that could
+    accumulate."""
+
+    types = {
+        DiscordSource : "DiscordSource",
+        discord.Server : "Server",
+        discord.Channel : "Channel",
+        discord.PrivateChannel : "PrivateChannel",
+        discord.Member : "Member",
+        discord.User : "User",
+        discord.Role : "Role",
+        discord.Message : "Message",
+    }
+    counts = heap.object_counts(types)
+    return "Objects: {}".format(", ".join("{} {}".format(name, count)
+                                          for name, count in counts.items()))
+
+async def bot_heapsnapshot_command(source, user):
+    """!heapsnapshot chat command"""
+
+    if not heap.is_tracing():
+        raise BotCommandException("Heap tracing is off, turn it on with "
+                                  "{}heaptrace on".format(
+                                      source.bot_command_prefix))
+
+    # Run the snapshot and object walk in a thread so that the event loop
+    # isn't stalled for their whole duration.
+    loop = asyncio.get_event_loop()
+    lines = await loop.run_in_executor(None, heap_report)
+    mgr = source.manager
+    lines.append("Caches: sources {}, messages {}, held pages {}, name index "
+                 "members {}".format(len(mgr.sources), len(mgr.messages),
+                                     len(mgr.page_cache),
+                                     len(mgr.member_index)))
+    await source.send_chat("\n".join(lines))
+
+async def bot_more_command(source, user):
+    """!more chat command"""
+
+    page = source.manager.page_cache.next_page(source.channel.id)
+    if not page:
+        raise BotCommandException("No more output to show.")
+
+    message_type, message, pages_left = page
+    metrics.inc("discord_more_pages_total")
+    await source.send_page(message, message_type, pages_left)
+
+async def bot_journal_command(source, user, count=None):
+    """!journal chat command"""
 
-@asyncio.coroutine
-def bot_listroles_command(source, user):
+    journal = source.manager.journal
+    if not journal:
+        raise BotCommandException("The command journal is not enabled.")
+
+    count = min(int(count), _journal_tail_max) if count else (
+        _journal_tail_default)
+    entries = journal.tail(count)
+    if not entries:
+        raise BotCommandException("The command journal is empty.")
+
+    await source.send_chat("\n".join(format_entry(e) for e in entries))
+
+async def bot_listroles_command(source, user):
     """!listroles chat command"""
 
     roles = source.get_vanity_roles()
     if not roles:
         raise BotCommandException("No available roles found.")
 
-    yield from source.send_chat(', '.join(r.name for r in roles))
+    await source.send_chat(', '.join(r.name for r in roles))
 
-@asyncio.coroutine
-def bot_addrole_command(source, user, rolename):
+async def bot_addrole_command(source, user, rolename):
     """!addrole chat command"""
 
     roles = source.get_vanity_roles()
@@ -477,18 +1296,20 @@ def bot_addrole_command(source, user, rolename):
                     "Member {} already has role {}".format(user.name,
                         rolename))
 
-        yield from source.manager.add_roles(user, r)
-        yield from source.send_chat(
+        await source.manager.add_roles(user, r)
+        await source.send_chat(
                 "Member {} has been given role {}".format(user.name, rolename))
         return
 
     raise BotCommandException("Unknown role: {}".format(rolename))
 
-@asyncio.coroutine
-def bot_removerole_command(source, user, rolename):
+async def bot_removerole_command(source, user, rolename):
     """!removerole chat command"""
 
     roles = source.get_vanity_roles()
+    if not roles:
+        raise BotCommandException("No available roles found.")
+
     for r in roles:
         if rolename.lower() != r.name.lower():
             continue
@@ -498,25 +1319,23 @@ def bot_removerole_command(source, user, rolename):
                     "Member {} does not have role {}".format(user.name,
                         rolename))
 
-        yield from source.manager.remove_roles(user, r)
-        yield from source.send_chat(
+        await source.manager.remove_roles(user, r)
+        await source.send_chat(
                 "Member {} has lost role {}".format(user.name, rolename))
         return
 
     raise BotCommandException("Unknown role: {}".format(rolename))
 
-@asyncio.coroutine
-def bot_glasses_command(source, user):
+async def bot_glasses_command(source, user):
     """!glasses chat command"""
 
-    message = yield from source.manager.send_message(source.channel, '( •_•)')
-    yield from asyncio.sleep(0.5)
-    yield from source.manager.edit_message(message, '( •_•)>⌐■-■')
-    yield from asyncio.sleep(0.5)
-    yield from source.manager.edit_message(message, '(⌐■_■)')
+    message = await source.manager.send_message(source.channel, '( •_•)')
+    await asyncio.sleep(0.5)
+    await source.manager.edit_message(message, '( •_•)>⌐■-■')
+    await asyncio.sleep(0.5)
+    await source.manager.edit_message(message, '(⌐■_■)')
 
-@asyncio.coroutine
-def bot_deal_command(source, user):
+async def bot_deal_command(source, user):
     """!deal chat command"""
 
     glasses = '    ⌐■-■    '
@@ -527,87 +1346,78 @@ def bot_deal_command(source, user):
              '            ',
              '    (•_•)   ']
     mgr = source.manager
-    message = yield from mgr.send_message(source.channel,
+    message = await mgr.send_message(source.channel,
             '```{}```'.format('\n'.join(lines)))
-    yield from asyncio.sleep(0.5)
+    await asyncio.sleep(0.5)
 
     for i in range(3):
-        yield from mgr.edit_message(message, '```{}```'.format(
+        await mgr.edit_message(message, '```{}```'.format(
             '\n'.join(lines[:i] + [glasses]+lines[i + 1:])))
-        yield from asyncio.sleep(0.5)
+        await asyncio.sleep(0.5)
 
-    yield from mgr.edit_message(message, '```{}```'.format(
+    await mgr.edit_message(message, '```{}```'.format(
         '\n'.join(lines[:1] + [dealwith] + lines[2:3] + [glasson])))
 
-@asyncio.coroutine
-def bot_dance_command(source, user):
+async def bot_dance_command(source, user):
     """!dance chat command"""
 
     mgr = source.manager
     figures = [':D|-<', ':D/-<', ':D|-<', r':D\\-<']
-    message = yield from mgr.send_message(source.channel, figures[0])
-    yield from asyncio.sleep(0.25)
+    message = await mgr.send_message(source.channel, figures[0])
+    await asyncio.sleep(0.25)
 
     for n in range(2):
         for f in figures[0 if n else 1:]:
-            yield from mgr.edit_message(message, f)
-            yield from asyncio.sleep(0.25)
+            await mgr.edit_message(message, f)
+            await asyncio.sleep(0.25)
 
-    yield from mgr.edit_message(message, figures[0])
+    await mgr.edit_message(message, figures[0])
 
-@asyncio.coroutine
-def bot_botdance_command(source, user):
+async def bot_botdance_command(source, user):
     """!botdance chat command"""
 
     mgr = source.manager
     figures = ['└[^_^]┐', '┌[^_^]┘']
-    message = yield from mgr.send_message(source.channel, figures[0])
-    yield from asyncio.sleep(0.25)
+    message = await mgr.send_message(source.channel, figures[0])
+    await asyncio.sleep(0.25)
 
     for n in range(2):
         for f in figures[0 if n else 1:]:
-            yield from mgr.edit_message(message, f)
-            yield from asyncio.sleep(0.25)
+            await mgr.edit_message(message, f)
+            await asyncio.sleep(0.25)
 
-    yield from mgr.edit_message(message, figures[0])
+    await mgr.edit_message(message, figures[0])
 
-@asyncio.coroutine
-def bot_say_command(source, user, server, channel, message):
-    """!say chat command"""
+def resolve_name(matches, name, kind, all_names):
+    """Pick the best of the ranked (rank, name, object) matches for a name,
+    raising a BotCommandException if there are none or if the best match is
+    ambiguous."""
 
-    mgr = source.manager
-    dest_server = None
-    for s in mgr.servers:
-        # Give exact matches priority
-        if server.lower() == s.name.lower():
-            dest_server = s
-            break
+    if not matches:
+        raise BotCommandException("Can't find {} match for {}, must "
+                "match one of: {}".format(kind, name, ", ".join(all_names)))
 
-        if server.lower() in s.name.lower():
-            dest_server = s
+    if len(matches) > 1 and matches[1][0] == matches[0][0]:
+        candidates = [m[1] for m in matches[:_max_name_candidates]]
+        if len(matches) > _max_name_candidates:
+            candidates.append("...")
+        raise BotCommandException("Ambiguous {} match for {}, best "
+                "matches are: {}".format(kind, name, ", ".join(candidates)))
 
-    if not dest_server:
-        raise BotCommandException("Can't find server match for {}, must "
-                "match one of: {}".format(server, ", ".join(
-                    sorted([s.name for s in mgr.servers]))))
+    return matches[0][2]
 
-    dest_channel = None
-    chan_filt = lambda c: c.type == discord.ChannelType.text
-    channels = list(filter(chan_filt, dest_server.channels))
-    for c in channels:
-        if channel.lower() == c.name.lower():
-            dest_channel = c
-            break
+async def bot_say_command(source, user, server, channel, message):
+    """!say chat command"""
 
-        elif channel.lower() in c.name.lower():
-            dest_channel = c
+    mgr = source.manager
+    dest_server = resolve_name(mgr.find_servers(server), server, "server",
+                               mgr.server_index.all_names())
 
-    if not dest_channel:
-        raise BotCommandException("Can't find channel match for {}, must "
-                "match one of: {}".format(channel,
-                    ", ".join(sorted([c.name for c in channels]))))
+    channel_index = mgr.channel_indexes[dest_server.id]
+    dest_channel = resolve_name(mgr.find_channels(dest_server, channel),
+                                channel, "channel", channel_index.all_names())
 
-    yield from mgr.send_message(dest_channel, message)
+    await mgr.send_message(dest_channel, message)
 
 def center_string_in_line(string, line):
    leftn = int((len(line) - len(string))/2)
@@ -628,8 +1438,7 @@ def render_firestorm_explosion(lines, radius):
 
     return newlines
 
-@asyncio.coroutine
-def bot_firestorm_command(source, user, target=None):
+async def bot_firestorm_command(source, user, target=None):
     """!firestorm chat command"""
 
     if not target:
@@ -657,17 +1466,17 @@ def bot_firestorm_command(source, user, target=None):
     mid = int(len(floor_lines) / 2)
     floor_lines[mid] = center_string_in_line(target, floor_lines[mid])
 
-    message = yield from mgr.send_message(source.channel,
+    message = await mgr.send_message(source.channel,
             '```{}```'.format('\n'.join(floor_lines)))
-    yield from asyncio.sleep(1)
+    await asyncio.sleep(1)
 
     for r in range(1, 5, 2):
         explosion = render_firestorm_explosion(floor_lines, r)
-        message = yield from mgr.edit_message(message,
+        message = await mgr.edit_message(message,
              '```{}```'.format('\n'.join(explosion)))
-        yield from asyncio.sleep(0.2)
+        await asyncio.sleep(0.2)
 
-    yield from asyncio.sleep(0.6)
+    await asyncio.sleep(0.6)
     fire_lines[mid] = center_string_in_line(target, fire_lines[mid])
     for i in range(0, 3):
         lines = list(fire_lines)
@@ -680,9 +1489,9 @@ def bot_firestorm_command(source, user, target=None):
             for c in coords:
                 lines[n] = lines[n][:4 + c] + 'v' + lines[n][4 + c + 1:]
 
-        yield from mgr.edit_message(message,
+        await mgr.edit_message(message,
                 '```{}```'.format('\n'.join(lines)))
-        yield from asyncio.sleep(0.8)
+        await asyncio.sleep(0.8)
 
 def render_glaciate_explosion(lines, radius):
     newlines = list(lines)
@@ -695,8 +1504,7 @@ def render_glaciate_explosion(lines, radius):
 
     return newlines
 
-@asyncio.coroutine
-def bot_glaciate_command(source, user, target=None):
+async def bot_glaciate_command(source, user, target=None):
     """!glaciate chat command"""
 
     if not target:
@@ -724,15 +1532,15 @@ def bot_glaciate_command(source, user, target=None):
     mid = int(len(floor_lines) / 2)
     floor_lines[mid] = center_string_in_line(target, floor_lines[mid])
 
-    message = yield from mgr.send_message(source.channel,
+    message = await mgr.send_message(source.channel,
             '```{}```'.format('\n'.join(floor_lines)))
-    yield from asyncio.sleep(1)
+    await asyncio.sleep(1)
 
     for r in range(1, 8, 2):
         explosion = render_glaciate_explosion(floor_lines, r)
-        message = yield from mgr.edit_message(message,
+        message = await mgr.edit_message(message,
              '```{}```'.format('\n'.join(explosion)))
-        yield from asyncio.sleep(0.2)
+        await asyncio.sleep(0.2)
 
     blasted = target
     if len(target) > 1:
@@ -743,7 +1551,7 @@ def bot_glaciate_command(source, user, target=None):
             blasted = blasted[:c] + '8' + blasted[c + 1:]
 
     ice_lines[mid] = center_string_in_line(blasted, ice_lines[mid])
-    yield from mgr.edit_message(message,
+    await mgr.edit_message(message,
             '```{}```'.format('\n'.join(ice_lines)))
 
 # Discord bot commands
@@ -767,10 +1575,41 @@ bot_commands = {
         "source_restriction" : "admin",
         "function" : bot_debugmode_command,
     },
+    "heaptrace" : {
+        "require_admin" : True,
+        "args" : [
+            {
+                "pattern" : r"(on|off)$",
+                "description" : "on|off",
+                "required" : False
+            } ],
+        "source_restriction" : "admin",
+        "function" : bot_heaptrace_command,
+    },
+    "heapsnapshot" : {
+        "require_admin" : True,
+        "source_restriction" : "admin",
+        "function" : bot_heapsnapshot_command,
+    },
+    "journal" : {
+        "require_admin" : True,
+        "args" : [
+            {
+                "pattern" : r"[0-9]+$",
+                "description" : "COUNT",
+                "required" : False
+            } ],
+        "source_restriction" : "admin",
+        "function" : bot_journal_command,
+    },
     "bothelp" : {
         "unlogged" : True,
         "function" : bot_help_command,
     },
+    "more" : {
+        "unlogged" : True,
+        "function" : bot_more_command,
+    },
     "listroles" : {
         "require_public_channel" : True,
         "unlogged" : True,
@@ -799,22 +1638,26 @@ bot_commands = {
     "glasses" : {
         "require_public_channel" : True,
         "unlogged" : True,
+        "cosmetic" : True,
         "source_restriction" : "channel",
         "function" : bot_glasses_command,
     },
     "deal" : {
         "require_public_channel" : True,
         "unlogged" : True,
+        "cosmetic" : True,
         "function" : bot_deal_command,
     },
     "dance" : {
         "require_public_channel" : True,
         "unlogged" : True,
+        "cosmetic" : True,
         "function" : bot_dance_command,
     },
     "botdance" : {
         "require_public_channel" : True,
         "unlogged" : True,
+        "cosmetic" : True,
         "function" : bot_botdance_command,
     },
     "say" : {
@@ -841,6 +1684,7 @@ bot_commands = {
     "firestorm" : {
         "require_public_channel" : True,
         "unlogged" : True,
+        "cosmetic" : True,
         "args" : [
             {
                 "pattern" : r".*",
@@ -852,6 +1696,7 @@ bot_commands = {
     "glaciate" : {
         "require_public_channel" : True,
         "unlogged" : True,
+        "cosmetic" : True,
         "args" : [
             {
                 "pattern" : r".*",
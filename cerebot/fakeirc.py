@@ -0,0 +1,295 @@
+"""A small local IRC server with stand-ins for the DCSS knowledge bots. It
+implements the subset of IRC used by beem's DCSSManager, so that the relay path
+can be exercised without connecting to a real network."""
+
+import asyncio
+import base64
+import logging
+import random
+import time
+
+_log = logging.getLogger()
+
+_server_name = "irc.fake.local"
+
+
+class FakeKnowledgeBot:
+    """A knowledge bot that answers every private message it receives. Replies
+    are sent after `latency` seconds plus up to `jitter` more, are between
+    `min_lines` and `max_lines` lines long with `line_delay` seconds between
+    lines, and a fraction `silence` of queries get no reply at all."""
+
+    def __init__(self, nick, latency=0.05, jitter=0.05, min_lines=1,
+                 max_lines=1, line_delay=0, silence=0, rand=None):
+        self.nick = nick
+        self.latency = latency
+        self.jitter = jitter
+        self.min_lines = min_lines
+        self.max_lines = max_lines
+        self.line_delay = line_delay
+        self.silence = silence
+        self.rand = rand if rand else random.Random()
+        self.queries = 0
+        self.silenced = 0
+
+    def parse_query(self, message):
+        """Return a tuple of the reply prefix and query text. Sequell receives
+        queries wrapped in a !RELAY command that carries the prefix to put on
+        each reply line."""
+
+        if not message.startswith("!RELAY "):
+            return "", message
+
+        prefix = ""
+        words = message.split(" ")[1:]
+        while len(words) > 1 and words[0].startswith("-"):
+            if words[0] == "-prefix":
+                prefix = words[1]
+            words = words[2:]
+
+        return prefix, " ".join(words)
+
+    async def answer(self, client, message):
+        self.queries += 1
+        if self.rand.random() < self.silence:
+            self.silenced += 1
+            return
+
+        await asyncio.sleep(self.latency
+                            + self.rand.random() * self.jitter)
+
+        prefix, query = self.parse_query(message)
+        count = self.rand.randint(self.min_lines, self.max_lines)
+        for n in range(count):
+            if n and self.line_delay:
+                await asyncio.sleep(self.line_delay)
+
+            client.send_from(self.nick, "PRIVMSG", client.nick,
+                             "{}{}: result {} of {}".format(prefix, query,
+                                                            n + 1, count))
+
+
+class FakeIRCClientProtocol(asyncio.Protocol):
+    """One client connection to the fake server. Incoming lines are processed
+    at most `flood_rate` per second once `flood_burst` lines have been
+    received quickly, in the manner of an ircd's flood throttling."""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b""
+        self.nick = None
+        self.user_seen = False
+        self.registered = False
+        self.lines = asyncio.Queue()
+        self.reader_task = None
+        self.flood_tokens = server.flood_burst
+        self.flood_time = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.clients.add(self)
+        self.reader_task = asyncio.ensure_future(self.process_lines())
+
+    def connection_lost(self, exc):
+        self.server.clients.discard(self)
+        if self.reader_task:
+            self.reader_task.cancel()
+
+    def data_received(self, data):
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            self.lines.put_nowait(line.rstrip(b"\r").decode("utf-8",
+                                                            "replace"))
+
+    def send_line(self, line):
+        if self.transport and not self.transport.is_closing():
+            self.transport.write((line + "\r\n").encode("utf-8"))
+
+    def send_from(self, source, command, *params):
+        """Send a message whose prefix is `source`, which is either a nick or
+        the server. The final parameter is always sent as a trailing one."""
+
+        if source == _server_name:
+            prefix = source
+        else:
+            prefix = "{0}!{0}@{1}".format(source, _server_name)
+
+        params = list(params)
+        if params:
+            params[-1] = ":" + params[-1]
+        self.send_line(":{} {} {}".format(prefix, command, " ".join(params)))
+
+    def send_numeric(self, numeric, *params):
+        self.send_from(_server_name, numeric, self.nick or "*", *params)
+
+    async def throttle(self):
+        if not self.server.flood_rate:
+            return
+
+        now = time.monotonic()
+        self.flood_tokens = min(self.server.flood_burst, self.flood_tokens
+                                + (now - self.flood_time)
+                                * self.server.flood_rate)
+        self.flood_time = now
+        if self.flood_tokens < 1:
+            self.server.throttled += 1
+            delay = (1 - self.flood_tokens) / self.server.flood_rate
+            await asyncio.sleep(delay)
+            self.flood_time = time.monotonic()
+            self.flood_tokens = 1
+
+        self.flood_tokens -= 1
+
+    async def process_lines(self):
+        while True:
+            line = await self.lines.get()
+            if not line:
+                continue
+
+            await self.throttle()
+            try:
+                self.handle_line(line)
+
+            except Exception:
+                _log.exception("Fake IRC: error handling line: %s", line)
+
+    def handle_line(self, line):
+        if line.startswith(":"):
+            line = line.split(" ", 1)[1]
+
+        trailing = None
+        if " :" in line:
+            line, trailing = line.split(" :", 1)
+        params = line.split()
+        command = params.pop(0).upper()
+        if trailing is not None:
+            params.append(trailing)
+
+        handler = getattr(self, "irc_" + command, None)
+        if handler:
+            handler(params)
+        elif self.registered:
+            self.send_numeric("421", command, "Unknown command")
+
+    def irc_CAP(self, params):
+        sub = params[0].upper() if params else ""
+        if sub == "LS":
+            self.send_from(_server_name, "CAP", "*", "LS", "sasl")
+        elif sub == "REQ":
+            self.send_from(_server_name, "CAP", "*", "ACK", params[-1])
+
+    def irc_AUTHENTICATE(self, params):
+        if params and params[0] == "PLAIN":
+            self.send_line("AUTHENTICATE +")
+            return
+
+        try:
+            fields = base64.b64decode(params[0]).split(b"\0")
+            account = fields[1].decode("utf-8")
+
+        except Exception:
+            self.send_numeric("904", "SASL authentication failed")
+            return
+
+        self.send_numeric("900", "{0}!{0}@{1}".format(account, _server_name),
+                          account, "You are now logged in as " + account)
+        self.send_numeric("903", "SASL authentication successful")
+
+    def irc_NICK(self, params):
+        nick = params[0]
+        if self.server.nick_in_use(nick, self):
+            self.send_numeric("433", nick, "Nickname is already in use")
+            return
+
+        self.nick = nick
+        self.maybe_register()
+
+    def irc_USER(self, params):
+        self.user_seen = True
+        self.maybe_register()
+
+    def maybe_register(self):
+        if self.registered or not self.nick or not self.user_seen:
+            return
+
+        self.registered = True
+        self.send_numeric("001", "Welcome to the fake IRC network "
+                          + self.nick)
+        self.send_numeric("002", "Your host is " + _server_name)
+        self.send_numeric("003", "This server was created just now")
+        self.send_numeric("004", _server_name, "fakeircd", "i", "nt")
+        self.send_numeric("375", "- {} Message of the day -".format(
+            _server_name))
+        self.send_numeric("376", "End of /MOTD command.")
+        self.server.registered.set()
+
+    def irc_PING(self, params):
+        self.send_from(_server_name, "PONG", _server_name,
+                       params[0] if params else _server_name)
+
+    def irc_PONG(self, params):
+        pass
+
+    def irc_MODE(self, params):
+        pass
+
+    def irc_JOIN(self, params):
+        for channel in params[0].split(","):
+            self.send_from(self.nick, "JOIN", channel)
+
+    def irc_PRIVMSG(self, params):
+        if len(params) < 2:
+            self.send_numeric("412", "No text to send")
+            return
+
+        bot = self.server.bots.get(params[0].lower())
+        if not bot:
+            self.send_numeric("401", params[0], "No such nick/channel")
+            return
+
+        asyncio.ensure_future(bot.answer(self, params[1]))
+
+    def irc_QUIT(self, params):
+        self.transport.close()
+
+
+class FakeIRCServer:
+    """An asyncio IRC server hosting the given FakeKnowledgeBot objects. The
+    `registered` event is set once a client has completed registration."""
+
+    def __init__(self, bots, host="127.0.0.1", port=0, flood_rate=0,
+                 flood_burst=10):
+        self.bots = {b.nick.lower() : b for b in bots}
+        self.host = host
+        self.port = port
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.throttled = 0
+        self.clients = set()
+        self.registered = asyncio.Event()
+        self.server = None
+
+    def nick_in_use(self, nick, client):
+        if nick.lower() in self.bots:
+            return True
+
+        for c in self.clients:
+            if c is not client and c.nick and c.nick.lower() == nick.lower():
+                return True
+
+        return False
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        self.server = await loop.create_server(
+                lambda: FakeIRCClientProtocol(self), self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for c in list(self.clients):
+            c.transport.close()
+
+        self.server.close()
+        await self.server.wait_closed()
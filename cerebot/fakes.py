@@ -0,0 +1,309 @@
+"""In-process stand-ins for the Discord and DCSS sides of the bot. These let
+the benchmark tools drive the real DiscordManager and DiscordSource code
+without any network connections."""
+
+import asyncio
+import discord
+import itertools
+import re
+import time
+
+from .discord import DiscordManager
+
+# Used to hand out unique snowflake-like IDs. Discord IDs are strings in the
+# versions of discord.py we support.
+_id_counter = itertools.count(100000000000000000)
+
+# Relay prefixes answered by the DCSS stub, matching the sample config.
+_relay_patterns = [r'^\?\?', r'(?i)^[qr]\?\?', r'[^?]\?\?\?? *$', r'^\?/',
+                   r'^&[-.\w]+( |$)', r'^\.[-.\w]+( |$)', r'^=[-.\w]+( |$)',
+                   r'(?i)^rip\b', r'^[@*]\?', r'^%([0-9]+\.[0-9]+)?\?',
+                   r'^%git']
+
+
+def next_id():
+    return str(next(_id_counter))
+
+
+class FakePermissions:
+    """Comparable stand-in for discord.Permissions."""
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, FakePermissions) and self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+class FakeRole:
+    def __init__(self, server, name, position, permissions=0,
+                 is_everyone=False):
+        self.id = next_id()
+        self.server = server
+        self.name = name
+        self.position = position
+        self.permissions = FakePermissions(permissions)
+        self.is_everyone = is_everyone
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGame:
+    def __init__(self, name, type=0):
+        self.name = name
+        self.type = type
+
+
+class FakeMember:
+    def __init__(self, server, name, bot=False, roles=None):
+        self.id = next_id()
+        self.server = server
+        self.name = name
+        self.nick = None
+        self.discriminator = "{:04}".format(int(self.id) % 10000)
+        self.bot = bot
+        self.roles = roles if roles is not None else []
+        self.game = None
+
+    @property
+    def display_name(self):
+        return self.nick if self.nick else self.name
+
+    @property
+    def mention(self):
+        return "<@{}>".format(self.id)
+
+    def __str__(self):
+        return "{}#{}".format(self.name, self.discriminator)
+
+
+class FakeChannel:
+    def __init__(self, server, name, is_private=False):
+        self.id = next_id()
+        self.server = server
+        self.name = name
+        self.is_private = is_private
+        self.type = (discord.ChannelType.private if is_private
+                     else discord.ChannelType.text)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeServer:
+    """A guild with its roles, members and text channels. The bot's own
+    member is given a "Bot" role so that vanity role commands work."""
+
+    def __init__(self, name, bot_user, channel_count=1, member_count=0,
+                 vanity_role_count=3):
+        self.id = next_id()
+        self.name = name
+        self.unavailable = False
+        self.roles = []
+        self.default_role = FakeRole(self, "@everyone", 0, is_everyone=True)
+        self.roles.append(self.default_role)
+        for n in range(vanity_role_count):
+            self.roles.append(FakeRole(self, "vanity{}".format(n), n + 1))
+        bot_role = FakeRole(self, "Bot", vanity_role_count + 1, permissions=8)
+        self.roles.append(bot_role)
+
+        self.me = FakeMember(self, bot_user.name, bot=True, roles=[bot_role])
+        self.me.id = bot_user.id
+        self._members = {self.me.id : self.me}
+        for n in range(member_count):
+            self.add_member("user{}".format(n))
+
+        self.channels = [FakeChannel(self, "channel{}".format(n))
+                         for n in range(channel_count)]
+
+    @property
+    def members(self):
+        return self._members.values()
+
+    def add_channel(self, name):
+        channel = FakeChannel(self, name)
+        self.channels.append(channel)
+        return channel
+
+    def add_member(self, name, bot=False):
+        member = FakeMember(self, name, bot)
+        self._members[member.id] = member
+        return member
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_member_named(self, name):
+        for m in self._members.values():
+            if m.name == name or m.nick == name or str(m) == name:
+                return m
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content):
+        self.id = next_id()
+        self.channel = channel
+        self.server = channel.server
+        self.author = author
+        self.content = content
+        self.reactions = []
+
+
+class FakeDiscordManager(DiscordManager):
+    """A DiscordManager that is never connected to Discord. Outgoing API calls
+    are recorded and complete after `send_latency` seconds, which stands in
+    for the REST round trip."""
+
+    def __init__(self, conf, dcss_manager, server_count=1, channel_count=1,
+                 member_count=10, send_latency=0, *args, **kwargs):
+        super().__init__(conf, dcss_manager, *args, **kwargs)
+
+        self.send_latency = send_latency
+        self.sent_messages = []
+        self.sent_times = []
+        self.closed = asyncio.Event()
+        self.edit_count = 0
+        self.role_changes = 0
+
+        self._fake_user = FakeMember(None, "Cerebot", bot=True)
+        self._fake_servers = []
+        self._fake_channels = {}
+        for n in range(server_count):
+            self.add_server("server{}".format(n), channel_count, member_count)
+
+    @property
+    def user(self):
+        return self._fake_user
+
+    @property
+    def servers(self):
+        return self._fake_servers
+
+    @property
+    def is_logged_in(self):
+        return True
+
+    @property
+    def is_closed(self):
+        return False
+
+    def add_server(self, name, channel_count=0, member_count=0):
+        server = FakeServer(name, self._fake_user, channel_count,
+                            member_count)
+        self._fake_servers.append(server)
+        for c in server.channels:
+            self._fake_channels[c.id] = c
+
+        return server
+
+    def add_channel(self, server, name):
+        """Add a text channel to the given server, or a private channel if the
+        server is None."""
+
+        if server:
+            channel = server.add_channel(name)
+        else:
+            channel = FakeChannel(None, name, is_private=True)
+
+        self._fake_channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, channel_id):
+        return self._fake_channels.get(channel_id)
+
+    async def _api_call(self):
+        self.outbound_pending += 1
+        try:
+            if self.send_latency:
+                await asyncio.sleep(self.send_latency)
+
+        finally:
+            self.outbound_pending -= 1
+
+    async def send_message(self, destination, content=None, *args, **kwargs):
+        await self._api_call()
+        message = FakeMessage(destination, self._fake_user, content)
+        self.sent_messages.append(message)
+        self.sent_times.append(time.perf_counter())
+        return message
+
+    async def edit_message(self, message, new_content=None, *args, **kwargs):
+        await self._api_call()
+        self.edit_count += 1
+        message.content = new_content
+        return message
+
+    async def add_reaction(self, message, emoji):
+        await self._api_call()
+        message.reactions.append(emoji)
+
+    async def add_roles(self, member, *roles):
+        await self._api_call()
+        self.role_changes += 1
+        member.roles.extend(r for r in roles if r not in member.roles)
+
+    async def remove_roles(self, member, *roles):
+        await self._api_call()
+        self.role_changes += 1
+        member.roles = [r for r in member.roles if r not in roles]
+
+    async def start(self):
+        await self.closed.wait()
+
+    async def disconnect(self, shutdown=False):
+        self.shutdown = shutdown
+        self.closed.set()
+
+
+class FakeDCSSManager:
+    """Stub for beem's DCSSManager. Queries matching the usual knowledge bot
+    prefixes are answered after `reply_latency` seconds with `reply_lines`
+    lines, routed back through the Discord manager's source lookup the same
+    way as replies from IRC."""
+
+    def __init__(self, reply_latency=0, reply_lines=1):
+        self.managers = {}
+        self.reply_latency = reply_latency
+        self.reply_lines = reply_lines
+        self.queries = 0
+        self.replies = 0
+        self.reply_tasks = set()
+        self.patterns = [re.compile(p) for p in _relay_patterns]
+
+    def is_dcss_message(self, message):
+        for p in self.patterns:
+            if p.search(message):
+                return True
+
+        return False
+
+    async def read_message(self, source, user, message):
+        self.queries += 1
+        task = asyncio.ensure_future(self.send_reply(
+                source.manager.service, source.get_source_ident(), message))
+        self.reply_tasks.add(task)
+        task.add_done_callback(self.reply_tasks.discard)
+
+    async def send_reply(self, service, source_ident, message):
+        if self.reply_latency:
+            await asyncio.sleep(self.reply_latency)
+
+        source = self.managers[service].get_source_by_ident(source_ident)
+        if not source:
+            return
+
+        message_type = "monster" if message[:2] in ("@?", "*?") else "normal"
+        for n in range(self.reply_lines):
+            await source.send_chat("{}: reply {}".format(message, n),
+                                   message_type)
+        self.replies += 1
+
+    async def start(self):
+        return
@@ -0,0 +1,272 @@
+"""Decoding of Discord gateway payloads, with zlib-stream transport
+compression, a choice of JSON parser, and dropping of unwanted events before
+they're parsed."""
+
+import asyncio
+import json
+import logging
+import re
+import zlib
+
+import discord
+from discord.gateway import (DiscordWebSocket, KeepAliveHandler,
+                             ReconnectWebSocket, ResumeWebSocket)
+
+_log = logging.getLogger()
+
+# Every zlib-stream message ends with a zlib sync flush marker.
+_zlib_suffix = b"\x00\x00\xff\xff"
+
+# The event type and sequence number of a dispatch payload. The event type is
+# looked for in every payload when any events are dropped, and the first match
+# is taken. Payloads put these keys first, before any nested keys with the same
+# names.
+_event_type_pattern = re.compile(rb'"t"\s*:\s*"([A-Z_]+)"')
+_sequence_pattern = re.compile(rb'"s"\s*:\s*([0-9]+)')
+
+# JSON parsers in order of preference for the "auto" backend.
+_json_backends = ["orjson", "ujson", "json"]
+
+
+def find_json_backend(name="auto"):
+    """Return the name of the JSON backend to use and its function to parse
+    UTF-8 bytes. With "auto", the fastest installed backend is used. A
+    requested backend that isn't installed falls back to the json module."""
+
+    names = _json_backends if name == "auto" else [name]
+    for n in names:
+        if n == "json":
+            break
+
+        try:
+            module = __import__(n)
+
+        except ImportError:
+            if name != "auto":
+                _log.warning("Discord: JSON backend %s is not installed, "
+                             "using json", n)
+            continue
+
+        return n, module.loads
+
+    # The json module only accepts bytes from Python 3.6.
+    return "json", lambda data: json.loads(data.decode("utf-8"))
+
+
+class GatewayDecoder:
+    """Turns frames received from the gateway into payload dicts. Binary
+    frames are inflated with one decompressor for the whole connection, as
+    required by zlib-stream. Dispatch payloads of the event types in
+    `drop_events` aren't parsed at all."""
+
+    def __init__(self, json_backend="auto", drop_events=()):
+        self.json_backend, self.loads = find_json_backend(json_backend)
+        self.drop_events = frozenset(e.encode("ascii") for e in drop_events)
+        self.inflator = zlib.decompressobj()
+        self.buffer = bytearray()
+        # The sequence number of the last payload dropped.
+        self.dropped_sequence = None
+        self.dropped = 0
+
+    def inflate(self, frame):
+        """Add a binary frame, returning the payload it completes, or None if
+        the payload continues in later frames."""
+
+        self.buffer.extend(frame)
+        if len(frame) < 4 or frame[-4:] != _zlib_suffix:
+            return
+
+        payload = self.inflator.decompress(self.buffer)
+        self.buffer = bytearray()
+        return payload
+
+    def decode(self, payload):
+        """Parse a payload, given as UTF-8 bytes. Returns None if the payload
+        is dropped, setting dropped_sequence."""
+
+        if self.drop_events:
+            match = _event_type_pattern.search(payload)
+            if match and match.group(1) in self.drop_events:
+                match = _sequence_pattern.search(payload)
+                self.dropped_sequence = int(match.group(1)) if match else None
+                self.dropped += 1
+                return
+
+        return self.loads(payload)
+
+
+class GatewayWebSocket(DiscordWebSocket):
+    """The discord.py gateway websocket, decoding payloads with a
+    GatewayDecoder. Options are set on subclasses made by configure()."""
+
+    # Whether the gateway URL requests zlib-stream transport compression.
+    # Otherwise each payload is compressed separately.
+    zlib_stream = True
+    json_backend = "auto"
+    drop_events = ()
+    # A file to append each payload to, one per line. Payloads are written
+    # as received, with message content, usernames and IDs, and aren't
+    # anonymized.
+    record_file = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decoder = GatewayDecoder(self.json_backend, self.drop_events)
+
+    @classmethod
+    def configure(cls, **options):
+        return type(cls.__name__, (cls,), options)
+
+    async def send_as_json(self, data):
+        # Payload compression can't be combined with transport compression.
+        if self.zlib_stream and data.get("op") == self.IDENTIFY:
+            data["d"]["compress"] = False
+
+        await super().send_as_json(data)
+
+    async def received_message(self, msg):
+        self._dispatch("socket_raw_receive", msg)
+
+        if isinstance(msg, bytes):
+            if self.zlib_stream:
+                msg = self.decoder.inflate(msg)
+                if msg is None:
+                    return
+            else:
+                msg = zlib.decompress(msg, 15, 10490000)
+        else:
+            msg = msg.encode("utf-8")
+
+        if self.record_file:
+            self.record_file.write(msg + b"\n")
+
+        state = self._connection
+        msg = self.decoder.decode(msg)
+        if msg is None:
+            if self.decoder.dropped_sequence is not None:
+                state.sequence = self.decoder.dropped_sequence
+            return
+
+        _log.debug("WebSocket Event: %s", msg)
+        self._dispatch("socket_response", msg)
+
+        op = msg.get("op")
+        data = msg.get("d")
+        seq = msg.get("s")
+        if seq is not None:
+            state.sequence = seq
+
+        if op == self.RECONNECT:
+            _log.info("Discord: Received RECONNECT opcode")
+            await self.close()
+            raise ReconnectWebSocket()
+
+        if op == self.HEARTBEAT_ACK:
+            self._keep_alive.ack()
+            return
+
+        if op == self.HEARTBEAT:
+            beat = self._keep_alive.get_payload()
+            await self.send_as_json(beat)
+            return
+
+        if op == self.HELLO:
+            interval = data["heartbeat_interval"] / 1000.0
+            self._keep_alive = KeepAliveHandler(ws=self, interval=interval)
+            self._keep_alive.start()
+            return
+
+        if op == self.INVALIDATE_SESSION:
+            if data == True:
+                await asyncio.sleep(5.0)
+                await self.close()
+                raise ResumeWebSocket()
+
+            state.sequence = None
+            state.session_id = None
+            await self.identify()
+            return
+
+        if op != self.DISPATCH:
+            _log.info("Discord: Unhandled gateway op %s", op)
+            return
+
+        event = msg.get("t")
+        if event == "READY":
+            state.clear()
+            state.sequence = msg["s"]
+            state.session_id = data["session_id"]
+
+        func = getattr(state, "parse_" + event.lower(), None)
+        if func:
+            func(data)
+        else:
+            _log.debug("Discord: Unhandled gateway event %s", event)
+
+        self.resolve_listeners(event, data)
+
+    def resolve_listeners(self, event, data):
+        """Complete the futures of wait_for() listeners for an event, as
+        DiscordWebSocket.received_message() does."""
+
+        removed = []
+        for index, entry in enumerate(self._dispatch_listeners):
+            if entry.event != event:
+                continue
+
+            future = entry.future
+            if future.cancelled():
+                removed.append(index)
+                continue
+
+            try:
+                valid = entry.predicate(data)
+
+            except Exception as e:
+                future.set_exception(e)
+                removed.append(index)
+
+            else:
+                if valid:
+                    ret = data if entry.result is None else entry.result(data)
+                    future.set_result(ret)
+                    removed.append(index)
+
+        for index in reversed(removed):
+            del self._dispatch_listeners[index]
+
+
+def use_zlib_stream(http):
+    """Have the gateway URL from a discord.py HTTP client request zlib-stream
+    transport compression. Does nothing if this was already done."""
+
+    get_gateway = http.get_gateway
+    if getattr(get_gateway, "zlib_stream", False):
+        return
+
+    async def get_stream_gateway():
+        return (await get_gateway()) + "&compress=zlib-stream"
+
+    get_stream_gateway.zlib_stream = True
+    http.get_gateway = get_stream_gateway
+
+
+async def run_gateway(client, ws_class):
+    """Connect a client to the gateway with the given websocket class and
+    process events until the connection is closed, reconnecting and resuming
+    as discord.Client.connect() does."""
+
+    client.ws = await ws_class.from_client(client)
+    while not client.is_closed:
+        try:
+            await client.ws.poll_event()
+
+        except (ReconnectWebSocket, ResumeWebSocket) as e:
+            resume = type(e) is ResumeWebSocket
+            _log.info("Discord: Got %s", type(e).__name__)
+            client.ws = await ws_class.from_client(client, resume=resume)
+
+        except discord.ConnectionClosed as e:
+            await client.close()
+            if e.code != 1000:
+                raise
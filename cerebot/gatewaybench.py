@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""cerebot-gatewaybench: Measure how quickly Discord gateway payloads are
+decoded, comparing discord.py's per-payload zlib and json decoding with the
+bot's zlib-stream decoder, JSON backend and event filtering.
+
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import time
+import zlib
+
+from .bench import print_report
+from .gateway import GatewayDecoder
+from .version import version
+
+# Relative frequency of each event type in the synthetic payloads, roughly
+# that of a bot on a few busy servers.
+_event_mix = [("PRESENCE_UPDATE", 60), ("TYPING_START", 15),
+              ("MESSAGE_CREATE", 20), ("GUILD_MEMBER_UPDATE", 3),
+              ("MESSAGE_UPDATE", 2)]
+
+_words = ["the", "orb", "of", "zot", "??", "hydra", "abyss", "gg", "rune",
+          "!lg", "trunk", "won", "sigmund", "pan", "lair"]
+
+
+def make_payload(rand, event, seq):
+    """Return a synthetic gateway dispatch payload for an event type."""
+
+    user = {"id" : str(rand.getrandbits(60)),
+            "username" : "user{}".format(rand.randrange(10000)),
+            "discriminator" : "{:04}".format(rand.randrange(10000)),
+            "avatar" : "{:032x}".format(rand.getrandbits(128))}
+    guild_id = str(rand.getrandbits(60))
+    if event == "PRESENCE_UPDATE":
+        data = {"user" : user, "guild_id" : guild_id,
+                "status" : rand.choice(["online", "idle", "dnd"]),
+                "roles" : [str(rand.getrandbits(60))
+                           for i in range(rand.randrange(4))],
+                "nick" : None,
+                "game" : {"name" : "Dungeon Crawl", "type" : 0}}
+    elif event == "TYPING_START":
+        data = {"user_id" : user["id"],
+                "channel_id" : str(rand.getrandbits(60)),
+                "timestamp" : 1496318400}
+    else:
+        data = {"id" : str(rand.getrandbits(60)),
+                "channel_id" : str(rand.getrandbits(60)),
+                "guild_id" : guild_id,
+                "author" : user,
+                "content" : " ".join(rand.choice(_words)
+                                     for i in range(rand.randrange(1, 20))),
+                "timestamp" : "2017-06-01T12:00:00.000000+00:00",
+                "edited_timestamp" : None, "tts" : False,
+                "mention_everyone" : False, "mentions" : [],
+                "mention_roles" : [], "attachments" : [], "embeds" : [],
+                "pinned" : False, "type" : 0}
+
+    return {"t" : event, "s" : seq, "op" : 0, "d" : data}
+
+
+def synthetic_payloads(count, seed):
+    rand = random.Random(seed)
+    events = [e for e, weight in _event_mix for i in range(weight)]
+    return [json.dumps(make_payload(rand, rand.choice(events), n + 1),
+                       separators=(",", ":")).encode("utf-8")
+            for n in range(count)]
+
+
+def read_payloads(path, limit):
+    """Read payloads written by the gateway_record_file option, one per
+    line."""
+
+    payloads = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                payloads.append(line)
+            if limit and len(payloads) >= limit:
+                break
+
+    return payloads
+
+
+def compress_payloads(payloads):
+    """Return the payloads compressed separately, as with payload compression,
+    and as frames of one zlib stream, as with zlib-stream transport
+    compression."""
+
+    separate = [zlib.compress(p) for p in payloads]
+    compressor = zlib.compressobj()
+    stream = [compressor.compress(p) + compressor.flush(zlib.Z_SYNC_FLUSH)
+              for p in payloads]
+    return separate, stream
+
+
+def decode_separate(frames):
+    """Decode as discord.py does, returning the number of payloads."""
+
+    count = 0
+    for frame in frames:
+        json.loads(zlib.decompress(frame, 15, 10490000).decode("utf-8"))
+        count += 1
+
+    return count
+
+
+def decode_stream(frames, decoder):
+    count = 0
+    for frame in frames:
+        payload = decoder.inflate(frame)
+        if payload is not None and decoder.decode(payload) is not None:
+            count += 1
+
+    return count
+
+
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def run_benchmark(args):
+    if args.payloads:
+        payloads = read_payloads(args.payloads, args.count)
+    else:
+        payloads = synthetic_payloads(args.count, args.seed)
+    if not payloads:
+        raise SystemExit("No payloads to decode")
+
+    separate, stream = compress_payloads(payloads)
+    # Drop the same events as the bot does with its default options.
+    drop_events = []
+    if not args.no_filter:
+        drop_events.append("TYPING_START")
+        if args.drop_presence:
+            drop_events.append("PRESENCE_UPDATE")
+    decoder = None
+
+    def run_stream():
+        nonlocal decoder
+        # Each run is a new connection, with a new zlib stream.
+        decoder = GatewayDecoder(args.json_backend, drop_events)
+        decode_stream(stream, decoder)
+
+    base_time = best_time(lambda: decode_separate(separate), args.repeat)
+    stream_time = best_time(run_stream, args.repeat)
+    count = len(payloads)
+
+    return {
+        "version" : version,
+        "python" : platform.python_version(),
+        "params" : {
+            "payloads" : args.payloads or "synthetic",
+            "count" : count,
+            "json_backend" : decoder.json_backend,
+            "drop_events" : ",".join(drop_events) or "none",
+            "repeat" : args.repeat,
+        },
+        "results" : {
+            "payload_bytes" : sum(len(p) for p in payloads),
+            "compressed_bytes" : sum(len(f) for f in separate),
+            "stream_compressed_bytes" : sum(len(f) for f in stream),
+            "dropped_payloads" : decoder.dropped,
+            "base_payloads_per_sec" : count / base_time,
+            "base_us_per_payload" : base_time / count * 1e6,
+            "stream_payloads_per_sec" : count / stream_time,
+            "stream_us_per_payload" : stream_time / count * 1e6,
+            "speedup" : base_time / stream_time,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payloads", metavar="<file>",
+                        help="payloads recorded with the gateway_record_file "
+                        "option, instead of synthetic ones.")
+    parser.add_argument("--count", type=int, default=20000,
+                        help="number of payloads to decode, or the most to "
+                        "read from the payload file (default: %(default)s).")
+    parser.add_argument("--json-backend", default="auto",
+                        choices=["auto", "orjson", "ujson", "json"],
+                        help="JSON parser for the bot's decoder (default: "
+                        "%(default)s).")
+    parser.add_argument("--drop-presence", action="store_true",
+                        help="also drop presence events, as with the "
+                        "gateway_drop_presence option.")
+    parser.add_argument("--no-filter", action="store_true",
+                        help="don't drop any events.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="take the best of this many runs (default: "
+                        "%(default)s).")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed for synthetic payloads (default: "
+                        "%(default)s).")
+    parser.add_argument("--json", dest="json_file", metavar="<file>",
+                        help="write the report as JSON to this file.")
+    parser.add_argument("--compare", metavar="<file>",
+                        help="show changes relative to a JSON report from a "
+                        "previous run.")
+    parser.add_argument("--version", action="version", version=version)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(args)
+    print_report(report, baseline)
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
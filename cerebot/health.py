@@ -0,0 +1,144 @@
+"""Monitoring the health of the Discord gateway connection."""
+
+import asyncio
+import collections
+import logging
+import time
+
+from .metrics import metrics
+
+_log = logging.getLogger()
+
+metrics.describe("discord_gateway_rtt_seconds",
+                 "Round trip time of the last gateway probe.")
+metrics.describe("discord_gateway_rtt_avg_seconds",
+                 "Mean round trip time of recent gateway probes.")
+metrics.describe("discord_gateway_receive_age_seconds",
+                 "Seconds since the last frame was received from the gateway.")
+metrics.describe("discord_gateway_probe_interval_seconds",
+                 "Current interval between gateway probes.")
+metrics.describe("discord_gateway_missed_probes_total",
+                 "Gateway probes that got no reply in time.")
+metrics.describe("discord_gateway_resumes_total",
+                 "Gateway resumes started because the connection looked dead.")
+
+
+class ConnectionMonitor:
+    """Probes the gateway websocket with pings, measuring round trip latency.
+
+    The probe interval shortens when a probe is slow or missed and lengthens
+    again while the connection is healthy. Probes are skipped while frames are
+    arriving, up to the maximum interval. A connection that misses several
+    probes in a row or receives nothing for `dead_timeout` seconds is
+    considered half-open, and the manager is asked to resume the session."""
+
+    def __init__(self, manager, conf):
+        self.manager = manager
+        self.min_interval = conf.get("health_min_interval", 5)
+        self.max_interval = conf.get("health_max_interval", 30)
+        self.probe_timeout = conf.get("health_probe_timeout", 10)
+        self.dead_timeout = conf.get("health_dead_timeout", 90)
+        self.max_missed = conf.get("health_max_missed", 2)
+
+        self.rtts = collections.deque(maxlen=20)
+        self.interval = self.min_interval
+        self.missed = 0
+        self.last_receive = time.monotonic()
+        self.last_probe = 0
+
+    def frame_received(self):
+        self.last_receive = time.monotonic()
+
+    def reset(self):
+        """Start afresh after the connection has been resumed or
+        re-established."""
+
+        self.missed = 0
+        self.interval = self.min_interval
+        self.last_receive = time.monotonic()
+
+    @property
+    def average_rtt(self):
+        if not self.rtts:
+            return None
+
+        return sum(self.rtts) / len(self.rtts)
+
+    async def probe(self):
+        """Ping the websocket and return the round trip time in seconds, or
+        None if no pong arrived in time."""
+
+        start = time.monotonic()
+        self.last_probe = start
+        try:
+            pong_waiter = await self.manager.ws.ping()
+            await asyncio.wait_for(pong_waiter, self.probe_timeout)
+
+        except asyncio.TimeoutError:
+            return None
+
+        return time.monotonic() - start
+
+    def adapt_interval(self, rtt):
+        """Probe more often when this probe was much slower than usual, and
+        back off gradually otherwise."""
+
+        average = self.average_rtt
+        self.rtts.append(rtt)
+        if average is not None and rtt > 2 * average + 0.05:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+
+    def update_metrics(self):
+        now = time.monotonic()
+        if self.rtts:
+            metrics.set("discord_gateway_rtt_seconds", self.rtts[-1])
+            metrics.set("discord_gateway_rtt_avg_seconds", self.average_rtt)
+        metrics.set("discord_gateway_receive_age_seconds",
+                    now - self.last_receive)
+        metrics.set("discord_gateway_probe_interval_seconds", self.interval)
+
+    async def run(self):
+        while not self.manager.is_closed:
+            await asyncio.sleep(self.interval)
+            self.update_metrics()
+
+            now = time.monotonic()
+            idle = now - self.last_receive
+            if idle >= self.dead_timeout:
+                await self.manager.resume_connection(
+                        "nothing received for {:.0f}s".format(idle))
+                self.reset()
+                continue
+
+            # Incoming frames show the connection is up.
+            if (idle < self.interval
+                    and now - self.last_probe < self.max_interval):
+                continue
+
+            try:
+                rtt = await self.probe()
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                self.manager.log_exception("Unable to probe the gateway")
+                rtt = None
+
+            if rtt is not None:
+                self.missed = 0
+                self.adapt_interval(rtt)
+                self.update_metrics()
+                continue
+
+            self.missed += 1
+            metrics.inc("discord_gateway_missed_probes_total")
+            self.interval = self.min_interval
+            _log.warning("Discord: Gateway probe %s of %s got no reply",
+                         self.missed, self.max_missed)
+            if self.missed >= self.max_missed:
+                await self.manager.resume_connection(
+                        "{} probes missed".format(self.missed))
+                self.reset()
@@ -0,0 +1,111 @@
+"""Heap snapshots with tracemalloc and object counts, for finding memory
+growth in a running bot. Nothing is traced until tracing is started."""
+
+import collections
+import gc
+import os
+import tracemalloc
+
+# Allocations made by tracemalloc itself and by imports aren't of interest.
+_snapshot_filters = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# The snapshot later snapshots are compared with. Tracing is process-wide,
+# so this outlives the Discord managers.
+_baseline = None
+
+
+def is_tracing():
+    return tracemalloc.is_tracing()
+
+
+def start_tracing():
+    tracemalloc.start()
+
+
+def stop_tracing():
+    global _baseline
+
+    _baseline = None
+    tracemalloc.stop()
+
+
+def take_snapshot():
+    """Take a snapshot of traced allocations, which becomes the baseline for
+    the next comparison. Returns the snapshot and the previous baseline, or
+    None if there was none."""
+
+    global _baseline
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_snapshot_filters)
+    previous = _baseline
+    _baseline = snapshot
+    return snapshot, previous
+
+
+def site_name(frame):
+    """The file of a frame relative to its package directory, and its
+    line."""
+
+    parts = frame.filename.split(os.sep)
+    return "{}:{}".format("/".join(parts[-2:]), frame.lineno)
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return "{:.0f} {}".format(size, unit)
+        size /= 1024
+
+    return "{:.1f} GiB".format(size)
+
+
+def top_sites(snapshot, limit):
+    """Return report lines for the allocation sites holding the most
+    memory."""
+
+    stats = snapshot.statistics("lineno")
+    total = sum(s.size for s in stats)
+    lines = ["Traced memory: {} in {} blocks".format(
+        format_size(total), sum(s.count for s in stats))]
+    for s in stats[:limit]:
+        lines.append("{}: {} in {} blocks".format(
+            site_name(s.traceback[0]), format_size(s.size), s.count))
+
+    return lines
+
+
+def growth_sites(snapshot, previous, limit):
+    """Return report lines for the allocation sites that grew the most since
+    the previous snapshot."""
+
+    stats = snapshot.compare_to(previous, "lineno")
+    total = sum(s.size_diff for s in stats)
+    # compare_to() sorts by the absolute change, so sites that shrank can come
+    # before ones that grew.
+    grown = sorted((s for s in stats if s.size_diff > 0),
+                   key=lambda s: s.size_diff, reverse=True)
+    lines = ["Traced memory change: {:+} bytes".format(total)]
+    for s in grown[:limit]:
+        lines.append("{}: {:+} bytes, {:+} blocks (now {})".format(
+            site_name(s.traceback[0]), s.size_diff, s.count_diff,
+            format_size(s.size)))
+
+    return lines
+
+
+def object_counts(types):
+    """Count the live objects of each of the given types, a dict of type
+    names keyed by type. Returns a dict of counts keyed by name."""
+
+    counts = collections.OrderedDict((name, 0) for name in types.values())
+    for obj in gc.get_objects():
+        name = types.get(type(obj))
+        if name:
+            counts[name] += 1
+
+    return counts
@@ -0,0 +1,236 @@
+"""A journal of the commands handled by the bot, kept in a fixed-size,
+memory-mapped ring buffer file, and the cerebot-journal command to read it.
+
+The file is a header followed by `capacity` fixed-size entry slots:
+
+    header: magic b"CBJR", format version (uint16), entry size (uint16),
+            capacity (uint32), entries written (uint64)
+    entry:  time (float64 epoch), server ID (uint64), channel ID (uint64),
+            user ID (uint64), latency in microseconds (uint32), outcome
+            (uint8), command (27 bytes, NUL-padded UTF-8)
+
+Entry `n` is written to slot `n % capacity`, so the file holds the last
+`capacity` entries. The server ID is 0 for private channels. All integers are
+little-endian.
+"""
+
+import argparse
+import collections
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+from .version import version
+
+_magic = b"CBJR"
+_format_version = 1
+_header = struct.Struct("<4sHHIQ")
+_entry = struct.Struct("<dQQQIB27s")
+
+# Command outcomes.
+OUTCOME_OK = 0
+OUTCOME_ERROR = 1
+OUTCOME_DROPPED = 2
+OUTCOME_DEFERRED = 3
+OUTCOME_REJECTED = 4
+outcome_names = ["ok", "error", "dropped", "deferred", "rejected"]
+
+Entry = collections.namedtuple("Entry", ["time", "server", "channel", "user",
+                                         "latency", "outcome", "command"])
+
+
+class JournalError(Exception):
+    pass
+
+
+def _open_map(path, capacity=None):
+    """Map the journal file at `path`. If `capacity` is given, the file is
+    opened for writing and created or reset if it doesn't match. Returns the
+    map and the header values."""
+
+    writable = capacity is not None
+    if writable:
+        size = _header.size + capacity * _entry.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, _header.size, 0)
+            if (len(header) < _header.size
+                    or _header.unpack(header)[:4] != (
+                        _magic, _format_version, _entry.size, capacity)
+                    or os.fstat(fd).st_size != size):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, _header.pack(_magic, _format_version,
+                                           _entry.size, capacity, 0), 0)
+
+            jmap = mmap.mmap(fd, size)
+
+        finally:
+            os.close(fd)
+
+    else:
+        with open(path, "rb") as f:
+            try:
+                jmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            except ValueError:
+                raise JournalError("Empty journal file: {}".format(path))
+
+    if len(jmap) < _header.size:
+        raise JournalError("Not a journal file: {}".format(path))
+
+    magic, format_version, entry_size, file_capacity, count = (
+        _header.unpack_from(jmap))
+    if magic != _magic:
+        raise JournalError("Not a journal file: {}".format(path))
+
+    if format_version != _format_version or entry_size != _entry.size:
+        raise JournalError("Unsupported journal version {} in {}".format(
+            format_version, path))
+
+    if len(jmap) < _header.size + file_capacity * _entry.size:
+        raise JournalError("Truncated journal file: {}".format(path))
+
+    return jmap, file_capacity, count
+
+
+def _read_entries(jmap, capacity, count, last=None):
+    """Yield the entries in the map, oldest first, or only the `last` most
+    recent."""
+
+    available = min(count, capacity)
+    if last is not None:
+        available = min(available, last)
+
+    for n in range(count - available, count):
+        pos = _header.size + (n % capacity) * _entry.size
+        (entry_time, server, channel, user, latency, outcome,
+         command) = _entry.unpack_from(jmap, pos)
+        yield Entry(entry_time, server, channel, user, latency / 1e6, outcome,
+                    command.rstrip(b"\0").decode("utf-8", "replace"))
+
+
+def format_entry(entry):
+    if entry.outcome < len(outcome_names):
+        outcome = outcome_names[entry.outcome]
+    else:
+        outcome = str(entry.outcome)
+
+    return "{} server {} channel {} user {} {} {} {:.1f}ms".format(
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.time)),
+        entry.server, entry.channel, entry.user, entry.command, outcome,
+        entry.latency * 1000)
+
+
+class CommandLogFilter(logging.Filter):
+    """Drops the informational records logged from a module's file, such as
+    the per-command lines that beem's chat module logs, which the journal
+    replaces. Warnings and errors are kept."""
+
+    def __init__(self, pathname):
+        super().__init__()
+        self.pathname = os.path.normcase(os.path.abspath(pathname))
+
+    def filter(self, record):
+        return (record.levelno > logging.INFO
+                or os.path.normcase(os.path.abspath(record.pathname))
+                != self.pathname)
+
+
+class CommandJournal:
+    """Writes command entries into the journal file at `path`, which holds the
+    last `capacity` entries. An existing journal with the same capacity is
+    continued."""
+
+    def __init__(self, path, capacity=65536):
+        self.path = path
+        self.map, self.capacity, self.count = _open_map(path, capacity)
+
+    def record(self, channel, user, command, outcome, latency=0):
+        if self.map is None:
+            return
+
+        server_id = 0 if channel.is_private else int(channel.server.id)
+        pos = _header.size + (self.count % self.capacity) * _entry.size
+        _entry.pack_into(self.map, pos, time.time(), server_id,
+                         int(channel.id), int(user.id),
+                         min(int(latency * 1e6), 0xffffffff), outcome,
+                         command.encode("utf-8")[:27])
+        self.count += 1
+        # The count is the last field of the header.
+        struct.pack_into("<Q", self.map, _header.size - 8, self.count)
+
+    def tail(self, count):
+        """Return the last `count` entries, oldest first."""
+
+        if self.map is None:
+            return []
+
+        return list(_read_entries(self.map, self.capacity, self.count,
+                                  count))
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+def read_entries(path, last=None):
+    """Yield the entries of the journal file at `path`, oldest first, or only
+    the `last` most recent."""
+
+    jmap, capacity, count = _open_map(path)
+    try:
+        yield from _read_entries(jmap, capacity, count, last)
+
+    finally:
+        jmap.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="cerebot-journal: Show entries of a command journal "
+        "written by the bot's journal_file option, oldest first.")
+    parser.add_argument("journal_file", metavar="<journal-file>",
+                        help="the journal file.")
+    parser.add_argument("-n", "--last", type=int, metavar="<count>",
+                        help="only read the last <count> entries.")
+    parser.add_argument("--command", help="show only this command.")
+    parser.add_argument("--server", type=int, metavar="<id>",
+                        help="show only commands from this server ID, or 0 "
+                        "for private channels.")
+    parser.add_argument("--channel", type=int, metavar="<id>",
+                        help="show only commands from this channel ID.")
+    parser.add_argument("--user", type=int, metavar="<id>",
+                        help="show only commands from this user ID.")
+    parser.add_argument("--outcome", choices=outcome_names,
+                        help="show only commands with this outcome.")
+    parser.add_argument("--since", type=float, metavar="<seconds>",
+                        help="show only commands from the last <seconds> "
+                        "seconds.")
+    parser.add_argument("--version", action="version", version=version)
+    args = parser.parse_args()
+
+    outcome = None
+    if args.outcome:
+        outcome = outcome_names.index(args.outcome)
+    since = time.time() - args.since if args.since else None
+
+    try:
+        for entry in read_entries(args.journal_file, args.last):
+            if ((args.command and entry.command != args.command)
+                    or (args.server is not None
+                        and entry.server != args.server)
+                    or (args.channel and entry.channel != args.channel)
+                    or (args.user and entry.user != args.user)
+                    or (outcome is not None and entry.outcome != outcome)
+                    or (since and entry.time < since)):
+                continue
+
+            print(format_entry(entry))
+
+    except (OSError, JournalError) as e:
+        sys.exit("Unable to read journal: {}".format(e))
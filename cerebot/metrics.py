@@ -0,0 +1,90 @@
+"""Counters and gauges describing the bot's behaviour, which can be exported
+to a file in the Prometheus text format for monitoring and alerting."""
+
+import asyncio
+import logging
+import os
+import time
+
+_log = logging.getLogger()
+
+
+class Metrics:
+    """A registry of named counters and gauges. Each can have labels, given as
+    keyword arguments."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.gauges[key] = value
+
+    def get(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key in self.gauges:
+            return self.gauges[key]
+
+        return self.counters.get(key, 0)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+
+        lines = []
+        for kind, table in (("counter", self.counters),
+                            ("gauge", self.gauges)):
+            last_name = None
+            for (name, labels), value in sorted(table.items()):
+                if name != last_name:
+                    if name in self.help:
+                        lines.append("# HELP {} {}".format(name,
+                                                           self.help[name]))
+                    lines.append("# TYPE {} {}".format(name, kind))
+                    last_name = name
+
+                label_text = ""
+                if labels:
+                    label_text = "{{{}}}".format(",".join(
+                        '{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                        for k, v in labels))
+                lines.append("{}{} {}".format(name, label_text, value))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to a file, replacing it atomically so a reader
+        never sees a partial file."""
+
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    async def export(self, path, interval):
+        """Write the metrics to `path` every `interval` seconds until
+        cancelled."""
+
+        while True:
+            self.set("cerebot_metrics_export_time_seconds", time.time())
+            try:
+                self.write(path)
+
+            except OSError as e:
+                _log.error("App: Unable to write metrics file %s: %s", path,
+                           e)
+
+            await asyncio.sleep(interval)
+
+
+# The registry used by the whole bot. It outlives the Discord managers, which
+# are recreated on every reconnect.
+metrics = Metrics()
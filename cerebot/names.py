@@ -0,0 +1,111 @@
+"""Indexes for finding Discord objects by name."""
+
+import bisect
+
+# Match ranks returned by NameIndex.search(), best first.
+EXACT_MATCH = 0
+PREFIX_MATCH = 1
+SUBSTRING_MATCH = 2
+
+
+def normalize_name(name):
+    """Return the key used to index and look up a name. Case and runs of
+    whitespace are ignored, as is a leading '#' for channel names."""
+
+    return " ".join(name.casefold().lstrip("#").split())
+
+
+class NameIndex:
+    """An index of objects by one or more names each, supporting exact, prefix
+    and substring lookup on normalized names. Objects are added and removed by
+    a unique ID so that renamed objects can be reindexed."""
+
+    def __init__(self):
+        self.objects = {}
+        # The display name and normalized keys of each object ID.
+        self.names = {}
+        self.keys = {}
+        # Object IDs for each key, and all keys in sorted order for prefix
+        # searches. The sorted keys are only built when a search needs them,
+        # with one sort, and are None when they need rebuilding.
+        self.key_ids = {}
+        self.sorted_keys = None
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj_id):
+        return obj_id in self.objects
+
+    def add(self, obj_id, obj, name, *aliases):
+        """Index `obj` under its display name and any aliases, replacing any
+        entry it already has."""
+
+        self.remove(obj_id)
+
+        keys = set()
+        for n in (name,) + aliases:
+            if n:
+                keys.add(normalize_name(n))
+
+        self.objects[obj_id] = obj
+        self.names[obj_id] = name
+        self.keys[obj_id] = keys
+        for k in keys:
+            ids = self.key_ids.get(k)
+            if ids is None:
+                ids = self.key_ids[k] = set()
+                self.sorted_keys = None
+            ids.add(obj_id)
+
+    def remove(self, obj_id):
+        if obj_id not in self.objects:
+            return
+
+        for k in self.keys.pop(obj_id):
+            ids = self.key_ids[k]
+            ids.discard(obj_id)
+            if not ids:
+                del self.key_ids[k]
+                self.sorted_keys = None
+
+        del self.objects[obj_id]
+        del self.names[obj_id]
+
+    def clear(self):
+        self.__init__()
+
+    def all_names(self):
+        return sorted(self.names.values(), key=str.casefold)
+
+    def search(self, query, exact_only=False):
+        """Return a list of (rank, name, object) tuples for objects matching
+        `query`, best matches first. The rank is one of EXACT_MATCH,
+        PREFIX_MATCH, or SUBSTRING_MATCH, and ties are broken by preferring
+        shorter names."""
+
+        key = normalize_name(query)
+        ranks = {}
+        for obj_id in self.key_ids.get(key, ()):
+            ranks[obj_id] = EXACT_MATCH
+
+        if not exact_only and key:
+            if self.sorted_keys is None:
+                self.sorted_keys = sorted(self.key_ids)
+
+            sorted_keys = self.sorted_keys
+            i = bisect.bisect_left(sorted_keys, key)
+            while i < len(sorted_keys) and sorted_keys[i].startswith(key):
+                for obj_id in self.key_ids[sorted_keys[i]]:
+                    ranks.setdefault(obj_id, PREFIX_MATCH)
+                i += 1
+
+            for k in sorted_keys:
+                if key in k:
+                    for obj_id in self.key_ids[k]:
+                        ranks.setdefault(obj_id, SUBSTRING_MATCH)
+
+        results = [(r, self.names[i], self.objects[i])
+                   for i, r in ranks.items()]
+        results.sort(key=lambda m: (m[0], len(m[1]), m[1].casefold()))
+        return results
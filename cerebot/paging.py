@@ -0,0 +1,121 @@
+"""Splitting long chat output into pages and holding the pages not yet
+sent."""
+
+import collections
+import time
+
+
+def paginate(text, size):
+    """Split text into pages of at most `size` characters, breaking between
+    lines where possible, and otherwise between words."""
+
+    if not size or len(text) <= size:
+        return [text]
+
+    pages = []
+    page = ""
+    for line in text.split("\n"):
+        while len(line) > size:
+            cut = line.rfind(" ", 0, size + 1)
+            if cut <= 0:
+                cut = size
+            if page:
+                pages.append(page)
+                page = ""
+            pages.append(line[:cut])
+            line = line[cut:].lstrip(" ")
+
+        if page and len(page) + 1 + len(line) > size:
+            pages.append(page)
+            page = line
+        elif page:
+            page += "\n" + line
+        else:
+            page = line
+
+    if page:
+        pages.append(page)
+
+    return pages
+
+
+class PageCache:
+    """The unsent pages of the last long output in each channel. Pages expire
+    after `ttl` seconds, and only the `max_channels` channels with the most
+    recent output are kept."""
+
+    def __init__(self, max_channels=100, ttl=300):
+        self.max_channels = max_channels
+        self.ttl = ttl
+        # Entries are (time stored, message type, deque of pages), keyed by
+        # channel ID, oldest first.
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def store(self, channel_id, pages, message_type):
+        """Hold the pages for the channel, replacing any it already has."""
+
+        self.entries.pop(channel_id, None)
+        self.entries[channel_id] = (time.time(), message_type,
+                                    collections.deque(pages))
+        while len(self.entries) > self.max_channels:
+            self.entries.popitem(last=False)
+
+    def next_page(self, channel_id):
+        """Return the message type and text of the channel's next page, and
+        the number of pages remaining after it, or None if the channel has no
+        pages."""
+
+        entry = self.entries.get(channel_id)
+        if not entry:
+            return
+
+        stored, message_type, pages = entry
+        if time.time() - stored >= self.ttl:
+            del self.entries[channel_id]
+            return
+
+        page = pages.popleft()
+        if not pages:
+            del self.entries[channel_id]
+
+        return message_type, page, len(pages)
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        while self.entries:
+            channel_id, (stored, _, _) = next(iter(self.entries.items()))
+            if stored >= cutoff:
+                break
+
+            del self.entries[channel_id]
+
+    def dump(self):
+        """Return the unexpired entries as a list of (channel ID, time stored,
+        message type, pages) tuples, oldest first."""
+
+        self.expire()
+        return [(channel_id, stored, message_type, list(pages))
+                for channel_id, (stored, message_type, pages)
+                in self.entries.items()]
+
+    def load(self, entries):
+        """Add entries returned by dump(), skipping expired ones. Returns the
+        number of entries added."""
+
+        cutoff = time.time() - self.ttl
+        count = 0
+        for channel_id, stored, message_type, pages in entries:
+            if stored < cutoff or not pages:
+                continue
+
+            self.entries[channel_id] = (stored, message_type,
+                                        collections.deque(pages))
+            count += 1
+
+        while len(self.entries) > self.max_channels:
+            self.entries.popitem(last=False)
+
+        return count
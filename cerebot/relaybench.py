@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""cerebot-relaybench: Run the full bot against a local fake IRC server with
+knowledge bot stand-ins and a fake Discord side, and measure DCSS relay
+throughput and reply latency.
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import re
+import tempfile
+import time
+
+from .app import Cerebot, new_event_loop
+from .bench import (add_load_arguments, generate_messages, percentile,
+                    print_report)
+from .fakeirc import FakeIRCServer, FakeKnowledgeBot
+from .fakes import FakeDiscordManager, FakeMessage
+from .version import version
+
+# Config for the bot under test. The knowledge bot patterns are those of the
+# sample config.
+_config_template = r"""
+[dcss]
+hostname = "127.0.0.1"
+port = {port}
+nick = "CerebotBench"
+
+[[dcss.bots]]
+nick = "Sequell"
+sequell_patterns = ['^\?\?', '(?i)^[qr]\?\?', '[^?]\?\?\?? *$', '^\?/',
+                    '^![-.\w]+( |$)', '^&[-.\w]+( |$)', '^\.[-.\w]+( |$)',
+                    '^=[-.\w]+( |$)', '(?i)^rip\b', '(?i)\bgong\b',
+                    '(?i)^cang$']
+
+[[dcss.bots]]
+nick = "Gretell"
+monster_patterns = ['^[@*]\?']
+
+[[dcss.bots]]
+nick = "Cheibriados"
+monster_patterns = ['^%([0-9]+\.[0-9]+)?\?']
+git_patterns = ['^%git']
+
+[discord]
+token = "bench"
+command_limit = 1000000000
+command_period = 1
+help_text = "Benchmark bot."
+
+[logging_config]
+level = 50
+"""
+
+# Each relay query is tagged with this so that replies can be matched to it.
+_query_tag_regexp = re.compile(r'\bq([0-9]+)\b')
+
+
+class BenchCerebot(Cerebot):
+    """Cerebot using a fake Discord manager, which stays 'connected' until the
+    bot is stopped."""
+
+    def __init__(self, config_file, args, loop):
+        self.args = args
+        super().__init__(config_file, loop=loop)
+
+    def new_discord_manager(self):
+        return FakeDiscordManager(self.conf.discord, self.dcss_manager,
+                                  server_count=self.args.servers,
+                                  channel_count=self.args.channels,
+                                  member_count=self.args.members,
+                                  send_latency=self.args.send_latency)
+
+
+def make_bots(args):
+    rand = random.Random(args.seed)
+    return [FakeKnowledgeBot(nick, args.bot_latency, args.bot_jitter,
+                             args.bot_min_lines, args.bot_max_lines,
+                             args.bot_line_delay, args.bot_silence, rand)
+            for nick in ("Sequell", "Gretell", "Cheibriados")]
+
+
+async def drive(bot, server, args):
+    process_task = asyncio.ensure_future(bot.process())
+
+    await asyncio.wait_for(server.registered.wait(),
+                           args.connect_timeout)
+    # Wait for the Discord side to be created.
+    while not bot.discord_manager:
+        await asyncio.sleep(0.01)
+
+    manager = bot.discord_manager
+    messages = generate_messages(manager, args, tag_queries=True)
+
+    interval = 1 / args.rate if args.rate else 0
+    start_times = {}
+    start = time.perf_counter()
+    for i, (channel, author, content) in enumerate(messages):
+        match = _query_tag_regexp.search(content)
+        if match:
+            start_times[int(match.group(1))] = time.perf_counter()
+
+        asyncio.ensure_future(manager.on_message(FakeMessage(channel, author,
+                                                             content)))
+        if interval:
+            await asyncio.sleep(max(0, start + (i + 1) * interval
+                                    - time.perf_counter()))
+        elif not i % 50:
+            await asyncio.sleep(0)
+
+    # Wait until replies stop arriving. Silent bots mean some never will.
+    deadline = time.perf_counter() + args.drain_timeout
+    quiet_period = args.bot_latency + args.bot_jitter + 1
+    seen = -1
+    while (time.perf_counter() < deadline
+           and len(manager.sent_messages) != seen):
+        seen = len(manager.sent_messages)
+        await asyncio.sleep(quiet_period)
+
+    bot.stop()
+    await process_task
+
+    first_reply = {}
+    reply_lines = 0
+    last_reply = start
+    for message, sent in zip(manager.sent_messages, manager.sent_times):
+        # Reply lines sent close together are joined into one message.
+        for tag in _query_tag_regexp.findall(message.content):
+            reply_lines += 1
+            last_reply = max(last_reply, sent)
+            tag = int(tag)
+            if tag in start_times and tag not in first_reply:
+                first_reply[tag] = sent - start_times[tag]
+
+    return last_reply - start, len(start_times), first_reply, reply_lines
+
+
+def run_benchmark(args):
+    loop = new_event_loop(args.loop == "uvloop")
+    server = FakeIRCServer(make_bots(args), flood_rate=args.flood_rate,
+                           flood_burst=args.flood_burst)
+    loop.run_until_complete(server.start())
+
+    fd, config_file = tempfile.mkstemp(suffix=".toml")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(_config_template.format(port=server.port))
+
+        bot = BenchCerebot(config_file, args, loop)
+        # The config's logging setup is done by now, so quiet it again.
+        logging.getLogger().setLevel(logging.CRITICAL)
+        elapsed, query_count, first_reply, reply_lines = (
+                loop.run_until_complete(drive(bot, server, args)))
+
+    finally:
+        os.remove(config_file)
+        loop.run_until_complete(server.stop())
+
+    latencies = list(first_reply.values())
+    return {
+        "version" : version,
+        "python" : platform.python_version(),
+        "params" : {k : v for k, v in sorted(vars(args).items())
+                    if k not in ("json_file", "compare")},
+        "results" : {
+            "queries" : query_count,
+            "answered" : len(latencies),
+            "reply_lines" : reply_lines,
+            "replies_per_sec" : reply_lines / elapsed if elapsed else 0.0,
+            "reply_latency_p50_ms" : percentile(latencies, 50) * 1e3,
+            "reply_latency_p99_ms" : percentile(latencies, 99) * 1e3,
+            "reply_latency_max_ms" : (max(latencies) * 1e3 if latencies
+                                      else 0.0),
+            "irc_throttled_lines" : server.throttled,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_load_arguments(parser)
+    parser.set_defaults(messages=1000, command_ratio=1.0, relay_share=1.0)
+    parser.add_argument("--rate", type=float, default=100,
+                        help="messages sent per second, or 0 for as fast as "
+                        "possible (default: %(default)s).")
+    parser.add_argument("--bot-latency", type=float, default=0.05,
+                        help="knowledge bot reply delay in seconds (default: "
+                        "%(default)s).")
+    parser.add_argument("--bot-jitter", type=float, default=0.05,
+                        help="random extra reply delay in seconds (default: "
+                        "%(default)s).")
+    parser.add_argument("--bot-min-lines", type=int, default=1,
+                        help="fewest lines in a reply (default: "
+                        "%(default)s).")
+    parser.add_argument("--bot-max-lines", type=int, default=3,
+                        help="most lines in a reply (default: %(default)s).")
+    parser.add_argument("--bot-line-delay", type=float, default=0,
+                        help="delay between lines of one reply (default: "
+                        "%(default)s).")
+    parser.add_argument("--bot-silence", type=float, default=0,
+                        help="fraction of queries never answered (default: "
+                        "%(default)s).")
+    parser.add_argument("--flood-rate", type=float, default=0,
+                        help="lines per second the IRC server accepts from "
+                        "the bot, or 0 for no limit (default: %(default)s).")
+    parser.add_argument("--flood-burst", type=int, default=10,
+                        help="lines accepted before flood throttling starts "
+                        "(default: %(default)s).")
+    parser.add_argument("--connect-timeout", type=float, default=10,
+                        help="seconds to wait for the IRC connection "
+                        "(default: %(default)s).")
+    parser.add_argument("--drain-timeout", type=float, default=30,
+                        help="seconds to wait for outstanding replies "
+                        "(default: %(default)s).")
+    parser.add_argument("--json", dest="json_file", metavar="<file>",
+                        help="write the report as JSON to this file.")
+    parser.add_argument("--compare", metavar="<file>",
+                        help="show changes relative to a JSON report from a "
+                        "previous run.")
+    parser.add_argument("--version", action="version", version=version)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(args)
+    print_report(report, baseline)
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""cerebot-replay: Replay a traffic log recorded by the bot through the
+Discord message handling path, using fakes for Discord and the DCSS relay.
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import time
+
+from .app import new_event_loop
+from .bench import make_conf, percentile, print_report
+from .fakes import FakeDCSSManager, FakeDiscordManager, FakeMember, FakeMessage
+from .traffic import (FLAG_BOT_AUTHOR, FLAG_PRIVATE, MESSAGE_RECORD,
+                      REPLY_RECORD, read_records)
+from .version import version
+
+
+class ReplayWorld:
+    """The fake servers, channels and members that stand in for the hashed IDs
+    of a traffic log. These are created as records refer to them."""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.servers = {}
+        self.channels = {}
+        self.members = {}
+
+    def get_channel(self, record):
+        channel = self.channels.get(record.channel)
+        if channel:
+            return channel
+
+        server = None
+        if not record.flags & FLAG_PRIVATE:
+            server = self.servers.get(record.server)
+            if not server:
+                server = self.manager.add_server("server{:08x}".format(
+                    record.server))
+                self.servers[record.server] = server
+
+        channel = self.manager.add_channel(server, "channel{:08x}".format(
+            record.channel))
+        self.channels[record.channel] = channel
+        return channel
+
+    def get_member(self, record, channel):
+        key = (record.server, record.user)
+        member = self.members.get(key)
+        if member:
+            return member
+
+        name = "user{:08x}".format(record.user)
+        is_bot = bool(record.flags & FLAG_BOT_AUTHOR)
+        if channel.server:
+            member = channel.server.add_member(name, is_bot)
+        else:
+            member = FakeMember(None, name, is_bot)
+        self.members[key] = member
+        return member
+
+
+async def replay(manager, dcss_manager, messages, speed):
+    """Send each (time, channel, author, content) tuple through on_message,
+    spaced by the recorded gaps divided by `speed`, or as fast as possible if
+    `speed` is 0. Returns the elapsed time and handling latencies."""
+
+    latencies = []
+
+    async def handle(message):
+        start = time.perf_counter()
+        await manager.on_message(message)
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    first_time = messages[0][0] if messages else 0
+    start = time.perf_counter()
+    for i, (record_time, channel, author, content) in enumerate(messages):
+        if speed:
+            delay = (start + (record_time - first_time) / speed
+                     - time.perf_counter())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif not i % 50:
+            await asyncio.sleep(0)
+
+        tasks.append(asyncio.ensure_future(handle(FakeMessage(channel, author,
+                                                              content))))
+
+    if tasks:
+        await asyncio.wait(tasks)
+    if dcss_manager.reply_tasks:
+        await asyncio.wait(list(dcss_manager.reply_tasks))
+    if manager.reply_flushes:
+        await asyncio.wait(list(manager.reply_flushes))
+
+    return time.perf_counter() - start, latencies
+
+
+def run_replay(args):
+    dcss_manager = FakeDCSSManager(args.relay_latency, args.relay_lines)
+    manager = FakeDiscordManager(make_conf(), dcss_manager, server_count=0,
+                                 send_latency=args.send_latency)
+    world = ReplayWorld(manager)
+
+    messages = []
+    recorded_replies = 0
+    for record in read_records(args.log_file):
+        if record.type == REPLY_RECORD:
+            recorded_replies += 1
+        elif record.type == MESSAGE_RECORD:
+            if args.limit and len(messages) >= args.limit:
+                continue
+
+            channel = world.get_channel(record)
+            author = world.get_member(record, channel)
+            messages.append((record.time, channel, author, record.content))
+
+    if not messages:
+        raise SystemExit("No messages found in {}".format(args.log_file))
+
+    loop = new_event_loop(args.loop == "uvloop")
+    elapsed, latencies = loop.run_until_complete(
+            replay(manager, dcss_manager, messages, args.speed))
+    count = len(latencies)
+
+    return {
+        "version" : version,
+        "python" : platform.python_version(),
+        "params" : {
+            "log_file" : args.log_file,
+            "loop" : args.loop,
+            "limit" : args.limit,
+            "speed" : args.speed,
+            "send_latency" : args.send_latency,
+            "relay_latency" : args.relay_latency,
+            "relay_lines" : args.relay_lines,
+        },
+        "results" : {
+            "messages" : count,
+            "recorded_span_sec" : messages[-1][0] - messages[0][0],
+            "elapsed_sec" : elapsed,
+            "messages_per_sec" : count / elapsed if elapsed else 0.0,
+            "latency_mean_us" : sum(latencies) / count * 1e6,
+            "latency_p50_us" : percentile(latencies, 50) * 1e6,
+            "latency_p99_us" : percentile(latencies, 99) * 1e6,
+            "latency_max_us" : max(latencies) * 1e6,
+            "relay_queries" : dcss_manager.queries,
+            "recorded_replies" : recorded_replies,
+            "sends" : len(manager.sent_messages),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("log_file", metavar="<log-file>",
+                        help="traffic log written by the bot's record_file "
+                        "option.")
+    parser.add_argument("--loop", choices=["asyncio", "uvloop"],
+                        default="asyncio",
+                        help="event loop to run on (default: %(default)s).")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed as a multiple of the recorded "
+                        "rate, or 0 for as fast as possible (default: "
+                        "%(default)s).")
+    parser.add_argument("--limit", type=int, default=0,
+                        help="replay at most this many messages.")
+    parser.add_argument("--send-latency", type=float, default=0,
+                        help="simulated Discord API latency in seconds "
+                        "(default: %(default)s).")
+    parser.add_argument("--relay-latency", type=float, default=0,
+                        help="simulated knowledge bot latency in seconds "
+                        "(default: %(default)s).")
+    parser.add_argument("--relay-lines", type=int, default=1,
+                        help="lines in each relay reply (default: "
+                        "%(default)s).")
+    parser.add_argument("--json", dest="json_file", metavar="<file>",
+                        help="write the report as JSON to this file.")
+    parser.add_argument("--compare", metavar="<file>",
+                        help="show changes relative to a JSON report from a "
+                        "previous run.")
+    parser.add_argument("--version", action="version", version=version)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    report = run_replay(args)
+    print_report(report, baseline)
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,76 @@
+"""Finding chat replies that exactly repeat one recently sent to the same
+channel."""
+
+import collections
+import time
+
+
+class RecentReply:
+    def __init__(self):
+        self.time = time.monotonic()
+        # The first message sent for the reply, once it's been sent.
+        self.message = None
+        self.reacted = False
+
+
+class RecentReplies:
+    """Hashes of the replies sent to each channel within the last `window`
+    seconds. Only the `max_channels` channels with the most recent replies
+    are kept."""
+
+    def __init__(self, window=5, max_channels=1000):
+        self.window = window
+        self.max_channels = max_channels
+        # Entries are (time of the latest reply, OrderedDict of RecentReply
+        # keyed by hash, oldest first), keyed by channel ID, oldest first.
+        self.entries = collections.OrderedDict()
+
+    def find(self, channel_id, key):
+        """Return the RecentReply for a reply hash sent to the channel within
+        the window, or None if there isn't one."""
+
+        entry = self.entries.get(channel_id)
+        if not entry:
+            return
+
+        reply = entry[1].get(key)
+        if reply and time.monotonic() - reply.time < self.window:
+            return reply
+
+    def add(self, channel_id, key):
+        """Add a reply hash for the channel, returning its new RecentReply."""
+
+        reply = RecentReply()
+        entry = self.entries.pop(channel_id, None)
+        replies = entry[1] if entry else collections.OrderedDict()
+        cutoff = reply.time - self.window
+        while replies:
+            old_key, old_reply = next(iter(replies.items()))
+            if old_reply.time >= cutoff:
+                break
+
+            del replies[old_key]
+
+        replies.pop(key, None)
+        replies[key] = reply
+        self.entries[channel_id] = (reply.time, replies)
+        while len(self.entries) > self.max_channels:
+            self.entries.popitem(last=False)
+
+        return reply
+
+    def remove(self, channel_id, key, reply):
+        """Remove a reply hash for the channel if its entry is `reply`."""
+
+        entry = self.entries.get(channel_id)
+        if entry and entry[1].get(key) is reply:
+            del entry[1][key]
+
+    def expire(self):
+        cutoff = time.monotonic() - self.window
+        while self.entries:
+            channel_id, (latest, _) = next(iter(self.entries.items()))
+            if latest >= cutoff:
+                break
+
+            del self.entries[channel_id]
@@ -0,0 +1,151 @@
+"""Keeping the "streaming" role of each server in step with member presence."""
+
+import asyncio
+import collections
+import discord
+import logging
+import time
+
+from .metrics import metrics
+
+_log = logging.getLogger()
+
+# How many role changes between progress messages for a server.
+_progress_interval = 50
+
+metrics.describe("discord_streaming_role_corrections_total",
+                 "Streaming roles added or removed when reconciling a "
+                 "server.")
+
+
+def find_streaming_role(server):
+    for r in server.roles:
+        if r.name.lower() == "streaming":
+            return r
+
+
+def is_streaming(member):
+    return bool(member.game and member.game.type == 1)
+
+
+class StreamingRoleReconciler:
+    """Corrects the streaming role of every member of a server, for use when
+    the server becomes available. Live presence changes are missed while the
+    bot is disconnected, so members can be left with the role after they've
+    stopped streaming, or without it while they stream.
+
+    Each server's changes are queued as a batch and applied by one worker at
+    no more than `streaming_role_rate` changes per second, so that a large
+    server doesn't exceed the API rate limits. Only members in the client's
+    cache can be checked."""
+
+    def __init__(self, manager, conf):
+        self.manager = manager
+        self.rate = conf.get("streaming_role_rate", 2)
+        # Batches of (server, members to add, members to remove), keyed by
+        # server ID in the order they were queued.
+        self.batches = collections.OrderedDict()
+        self.batch_ready = asyncio.Event()
+        self.task = None
+
+    def reconcile(self, server):
+        """Queue a batch of the changes needed to make the holders of the
+        server's streaming role the members who are streaming."""
+
+        if server.unavailable:
+            return
+
+        role = find_streaming_role(server)
+        if not role:
+            return
+
+        streaming = set()
+        holders = set()
+        for m in server.members:
+            if is_streaming(m):
+                streaming.add(m)
+            if role in m.roles:
+                holders.add(m)
+
+        adds = streaming - holders
+        removes = holders - streaming
+        if not adds and not removes:
+            return
+
+        _log.info("Discord: Reconciling streaming role on server %s: %s to "
+                  "add, %s to remove", server, len(adds), len(removes))
+
+        # A newer batch for the server replaces any still queued.
+        self.batches.pop(server.id, None)
+        self.batches[server.id] = (server, adds, removes)
+        self.batch_ready.set()
+        if not self.task or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    async def apply_batch(self, server, adds, removes):
+        role = find_streaming_role(server)
+        if not role:
+            return
+
+        start = time.monotonic()
+        changes = [(m, True) for m in adds] + [(m, False) for m in removes]
+        corrections = 0
+        for i, (member, add) in enumerate(changes, 1):
+            # Skip members who have left or whose presence has changed since
+            # the batch was made.
+            member = server.get_member(member.id)
+            if (not member or is_streaming(member) != add
+                    or (role in member.roles) == add):
+                continue
+
+            try:
+                if add:
+                    await self.manager.add_roles(member, role)
+                else:
+                    await self.manager.remove_roles(member, role)
+
+            except discord.Forbidden:
+                _log.error("Discord: Not allowed to change streaming role on "
+                           "server %s", server)
+                return
+
+            except discord.HTTPException:
+                self.manager.log_exception("Unable to change streaming role")
+
+            else:
+                corrections += 1
+                metrics.inc("discord_streaming_role_corrections_total",
+                            action="add" if add else "remove")
+                if not i % _progress_interval:
+                    _log.info("Discord: Reconciled %s of %s streaming role "
+                              "changes on server %s", i, len(changes),
+                              server)
+
+            # Failed requests count against the rate limit too.
+            await asyncio.sleep(1 / self.rate)
+
+        _log.info("Discord: Streaming role on server %s reconciled with %s "
+                  "corrections in %.1fs", server, corrections,
+                  time.monotonic() - start)
+
+    async def run(self):
+        while not self.manager.is_closed:
+            if not self.batches:
+                self.batch_ready.clear()
+                await self.batch_ready.wait()
+                continue
+
+            server_id, batch = self.batches.popitem(last=False)
+            try:
+                await self.apply_batch(*batch)
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                self.manager.log_exception("Unable to reconcile streaming "
+                                           "role")
@@ -0,0 +1,171 @@
+"""Fair scheduling of command handling across servers."""
+
+import asyncio
+import collections
+import time
+
+from .metrics import metrics
+
+# Deficit added to a server's queue each turn. A command of the default cost
+# of 1 can start every turn.
+_quantum = 1
+
+metrics.describe("discord_schedule_wait_seconds_sum",
+                 "Total time commands waited in their server's queue.")
+metrics.describe("discord_schedule_wait_seconds_count",
+                 "Commands started from their server's queue.")
+metrics.describe("discord_schedule_queue_depth",
+                 "Commands waiting in each server's queue.")
+metrics.describe("discord_schedule_running",
+                 "Command handlers running.")
+
+
+class ServerQueue:
+    def __init__(self, key):
+        self.key = key
+        # Entries are (cost, time queued, function, future).
+        self.jobs = collections.deque()
+        self.deficit = 0
+        self.running = 0
+
+
+class FairScheduler:
+    """Runs command handlers from per-server queues, using deficit round
+    robin so that a busy server can't starve the others.
+
+    Servers with queued commands take turns. Each turn adds `_quantum` to the
+    server's deficit, and a command can start once the deficit covers its
+    cost. No server runs more than `server_concurrency` handlers at once, and
+    no more than `max_running` run in total."""
+
+    def __init__(self, conf):
+        self.server_concurrency = conf.get("schedule_server_concurrency", 4)
+        self.max_running = conf.get("schedule_max_running", 32)
+
+        self.queues = {}
+        # Queues with jobs waiting, in turn order.
+        self.active = collections.deque()
+        self.running = 0
+
+    async def run(self, key, cost, function):
+        """Call `function`, a coroutine function taking no arguments, for the
+        server identified by `key` once the scheduler allows it, returning its
+        result."""
+
+        queue = self.queues.get(key)
+        if not queue:
+            queue = self.queues[key] = ServerQueue(key)
+
+        # With nothing queued for the server and a free handler, the call
+        # would start at once, so skip the queue.
+        if (not queue.jobs and queue.running < self.server_concurrency
+                and self.running < self.max_running):
+            metrics.inc("discord_schedule_wait_seconds_count", server=key)
+            self.job_started(queue)
+            try:
+                return await function()
+
+            finally:
+                self.job_finished(queue)
+
+        return await self.submit(queue, cost, function)
+
+    def submit(self, queue, cost, function):
+        """Queue a call of `function` on a server's queue. Returns a future
+        with the result of the call."""
+
+        future = asyncio.Future()
+        if not queue.jobs:
+            self.active.append(queue)
+        queue.jobs.append((cost, time.monotonic(), function, future))
+        metrics.set("discord_schedule_queue_depth", len(queue.jobs),
+                    server=queue.key)
+
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        """Start queued jobs while there are free handlers."""
+
+        # Queues passed over in a row because they're at their concurrency
+        # limit.
+        blocked = 0
+        while (self.active and self.running < self.max_running
+               and blocked < len(self.active)):
+            queue = self.active[0]
+            if queue.running >= self.server_concurrency:
+                blocked += 1
+                self.active.rotate(-1)
+                continue
+
+            blocked = 0
+            cost, queued, function, future = queue.jobs[0]
+            # Skip jobs whose callers have stopped waiting.
+            if future.cancelled():
+                self.remove_job(queue)
+                if not queue.jobs and not queue.running:
+                    del self.queues[queue.key]
+                continue
+
+            if queue.deficit < cost:
+                queue.deficit += _quantum
+                self.active.rotate(-1)
+                continue
+
+            queue.deficit -= cost
+            self.remove_job(queue)
+            self.start(queue, queued, function, future)
+
+    def remove_job(self, queue):
+        """Remove the first job of the queue at the head of the turn order."""
+
+        queue.jobs.popleft()
+        if not queue.jobs:
+            queue.deficit = 0
+            self.active.popleft()
+
+    def start(self, queue, queued, function, future):
+        wait = time.monotonic() - queued
+        key = queue.key
+        metrics.inc("discord_schedule_wait_seconds_sum", wait, server=key)
+        metrics.inc("discord_schedule_wait_seconds_count", server=key)
+        metrics.set("discord_schedule_queue_depth", len(queue.jobs),
+                    server=key)
+        self.job_started(queue)
+        asyncio.ensure_future(self.run_job(queue, function, future))
+
+    def job_started(self, queue):
+        queue.running += 1
+        self.running += 1
+        metrics.set("discord_schedule_running", self.running)
+
+    def job_finished(self, queue):
+        queue.running -= 1
+        self.running -= 1
+        metrics.set("discord_schedule_running", self.running)
+        if not queue.running and not queue.jobs:
+            del self.queues[queue.key]
+
+        self.dispatch()
+
+    async def run_job(self, queue, function, future):
+        try:
+            if future.cancelled():
+                return
+
+            result = await function()
+
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+        except Exception as e:
+            if not future.cancelled():
+                future.set_exception(e)
+
+        else:
+            if not future.cancelled():
+                future.set_result(result)
+
+        finally:
+            self.job_finished(queue)
@@ -0,0 +1,158 @@
+"""Saving the bot's caches to disk at shutdown, so that a restarted bot can
+start warm.
+
+A snapshot file is a header, a table of sections, and the section data:
+
+    header: magic b"CBSS", format version (uint16), creation time (float64
+            epoch), section count (uint32)
+    section entry: name (16 bytes, NUL-padded ASCII), offset (uint32),
+                   length (uint32)
+
+Each section is zlib-compressed JSON. The file is memory-mapped when loaded,
+and a section is only decompressed and decoded the first time it's used. All
+integers are little-endian.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+_log = logging.getLogger()
+
+_magic = b"CBSS"
+_format_version = 1
+_header = struct.Struct("<4sHdI")
+_section_entry = struct.Struct("<16sII")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(path, sections):
+    """Write a snapshot of the given sections, a dict of JSON-serializable
+    values keyed by section name. The file is replaced atomically. Returns
+    the size of the file."""
+
+    blobs = []
+    for name, value in sections.items():
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        blobs.append((name.encode("ascii"), zlib.compress(data)))
+
+    offset = _header.size + _section_entry.size * len(blobs)
+    parts = [_header.pack(_magic, _format_version, time.time(), len(blobs))]
+    for name, blob in blobs:
+        parts.append(_section_entry.pack(name, offset, len(blob)))
+        offset += len(blob)
+    parts.extend(blob for name, blob in blobs)
+
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        for p in parts:
+            f.write(p)
+    os.replace(tmp_path, path)
+    return offset
+
+
+class Snapshot:
+    """A snapshot file opened for reading. Only the header and section table
+    are read when it's opened."""
+
+    def __init__(self, path):
+        self.path = path
+        self.sections = {}
+        self.values = {}
+        self.map = None
+
+        with open(path, "rb") as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data = self.map
+
+            # Empty files and some filesystems can't be mapped.
+            except (ValueError, OSError):
+                self.data = f.read()
+
+        self.size = len(self.data)
+        if self.size < _header.size:
+            raise SnapshotError("File is too short")
+
+        magic, format_version, self.created, count = _header.unpack_from(
+            self.data)
+        if magic != _magic:
+            raise SnapshotError("Not a snapshot file")
+
+        if format_version != _format_version:
+            raise SnapshotError("Unsupported format version {}".format(
+                format_version))
+
+        for i in range(count):
+            pos = _header.size + i * _section_entry.size
+            if pos + _section_entry.size > self.size:
+                raise SnapshotError("Section table is truncated")
+
+            name, offset, length = _section_entry.unpack_from(self.data, pos)
+            if offset + length > self.size:
+                raise SnapshotError("Section data is truncated")
+
+            self.sections[name.rstrip(b"\0").decode("ascii")] = (offset,
+                                                                 length)
+
+    @property
+    def age(self):
+        return time.time() - self.created
+
+    def section(self, name, default=None):
+        """Return the decoded value of a section, or `default` if the snapshot
+        doesn't have it or it can't be decoded."""
+
+        if name in self.values:
+            return self.values[name]
+
+        if name not in self.sections:
+            return default
+
+        offset, length = self.sections[name]
+        try:
+            value = json.loads(zlib.decompress(
+                self.data[offset:offset + length]).decode("utf-8"))
+
+        except (zlib.error, ValueError) as e:
+            _log.warning("App: Discarding snapshot section %s: %s", name, e)
+            value = default
+
+        self.values[name] = value
+        return value
+
+    def close(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        self.data = b""
+
+
+def load_snapshot(path, max_age):
+    """Open the snapshot at `path`, returning None if there isn't one or it
+    can't be used. Snapshots older than `max_age` seconds are ignored."""
+
+    if not os.path.exists(path):
+        return
+
+    try:
+        snapshot = Snapshot(path)
+
+    except (OSError, SnapshotError) as e:
+        _log.warning("App: Ignoring snapshot file %s: %s", path, e)
+        return
+
+    if snapshot.age > max_age:
+        _log.info("App: Ignoring snapshot file %s, which is %.0f seconds old",
+                  path, snapshot.age)
+        snapshot.close()
+        return
+
+    return snapshot
@@ -0,0 +1,43 @@
+"""Profiling of where startup time goes."""
+
+import logging
+import time
+
+_log = logging.getLogger()
+
+
+class StartupProfile:
+    """Records when each phase of startup finished, relative to the time the
+    profile was created."""
+
+    def __init__(self, start_time=None):
+        self.start_time = start_time if start_time else time.perf_counter()
+        self.phases = []
+        self.finished = False
+
+    def mark(self, phase):
+        """Record the end of a phase. Only the first mark of each phase is
+        kept."""
+
+        if self.finished or any(p == phase for p, t in self.phases):
+            return
+
+        self.phases.append((phase, time.perf_counter()))
+
+    def finish(self):
+        """Print and log the phase breakdown, and stop recording phases."""
+
+        if self.finished:
+            return
+
+        self.finished = True
+        lines = ["Startup profile (ms since start, ms in phase):"]
+        last = self.start_time
+        for phase, t in self.phases:
+            lines.append("  {:16} {:9.1f} {:9.1f}".format(
+                phase, (t - self.start_time) * 1000, (t - last) * 1000))
+            last = t
+
+        for line in lines:
+            print(line)
+            _log.info(line)
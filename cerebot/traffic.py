@@ -0,0 +1,175 @@
+"""Recording of Discord traffic to a compact, anonymized binary log, for
+replaying against the bot later.
+
+A log is one or more segments, one for each time a recorder was opened on the
+file. A segment is a header followed by records:
+
+    header: magic b"CBRL", format version (uint8), start time (float64 epoch)
+    record: type (uint8), ms since segment start (uint32), server hash
+            (uint32), channel hash (uint32), user hash (uint32), flags (uint8),
+            length (uint16)
+
+Inbound message records are followed by `length` bytes of UTF-8 content. Reply
+records have no payload; their length is the number of characters sent and
+their flags hold the message type. All integers are little-endian.
+
+Discord IDs are hashed with a salt that exists only in memory for the life of
+the process, so the log can't be mapped back to users, channels or servers.
+Only messages the bot handles as commands or relay queries keep their text,
+with any mentions removed. Other chat is replaced by filler of the same
+length.
+"""
+
+import collections
+import hashlib
+import os
+import re
+import struct
+import time
+
+MESSAGE_RECORD = 1
+REPLY_RECORD = 2
+
+# Flags for inbound messages.
+FLAG_PRIVATE = 1
+FLAG_BOT_AUTHOR = 2
+FLAG_SCRUBBED = 4
+
+# Reply message types, stored in the flags of reply records.
+reply_types = ["normal", "action", "monster"]
+
+_magic = b"CBRL"
+_format_version = 1
+_header = struct.Struct("<4sBd")
+_record = struct.Struct("<BIIIIBH")
+
+_salt = os.urandom(16)
+
+_mention_regexp = re.compile(r'<(@[!&]?|#)[0-9]+>')
+
+Record = collections.namedtuple("Record", ["type", "time", "server", "channel",
+                                           "user", "flags", "length",
+                                           "content"])
+
+
+def anonymize_id(value):
+    """Hash a Discord ID to a 32-bit integer. None hashes to 0."""
+
+    if value is None:
+        return 0
+
+    digest = hashlib.sha256(_salt + str(value).encode("utf-8")).digest()
+    return struct.unpack("<I", digest[:4])[0] or 1
+
+
+def anonymize_content(content, is_command):
+    """Return a tuple of the content to store and whether it was scrubbed.
+    Only the text of commands is kept."""
+
+    if is_command:
+        return _mention_regexp.sub("<@0>", content), False
+
+    return "x" * len(content), True
+
+
+class TrafficRecorder:
+    """Appends a segment of inbound message and reply records to a log file.
+    Writes are buffered and flushed at most every `flush_interval`
+    seconds."""
+
+    def __init__(self, path, flush_interval=5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.start_time = time.time()
+        self.last_flush = self.start_time
+        self.file = open(path, "ab", buffering=64 * 1024)
+        self.file.write(_header.pack(_magic, _format_version,
+                                     self.start_time))
+
+    def _write(self, record_type, server, channel, user, flags, length,
+               payload=b""):
+        now = time.time()
+        offset = int((now - self.start_time) * 1000)
+        self.file.write(_record.pack(record_type, offset, server, channel,
+                                     user, flags, length))
+        if payload:
+            self.file.write(payload)
+
+        if now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+    def channel_ids(self, channel):
+        server_id = None if channel.is_private else channel.server.id
+        return anonymize_id(server_id), anonymize_id(channel.id)
+
+    def record_message(self, channel, author, content, is_command):
+        server, channel = self.channel_ids(channel)
+        content, scrubbed = anonymize_content(content, is_command)
+        payload = content.encode("utf-8")[:0xffff]
+
+        flags = 0
+        if scrubbed:
+            flags |= FLAG_SCRUBBED
+        if not server:
+            flags |= FLAG_PRIVATE
+        if author.bot:
+            flags |= FLAG_BOT_AUTHOR
+
+        self._write(MESSAGE_RECORD, server, channel, anonymize_id(author.id),
+                    flags, len(payload), payload)
+
+    def record_reply(self, channel, message, message_type):
+        server, channel = self.channel_ids(channel)
+        if message_type in reply_types:
+            type_code = reply_types.index(message_type)
+        else:
+            type_code = 0
+
+        self._write(REPLY_RECORD, server, channel, 0, type_code,
+                    min(len(message), 0xffff))
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_records(path):
+    """Yield a Record for each entry in the log file at `path`. The record
+    time is seconds since the epoch."""
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    pos = 0
+    start_time = None
+    while pos < len(data):
+        if data[pos:pos + len(_magic)] == _magic:
+            magic, file_version, start_time = _header.unpack_from(data, pos)
+            if file_version != _format_version:
+                raise ValueError("Unsupported traffic log version {} in "
+                                 "{}".format(file_version, path))
+            pos += _header.size
+            continue
+
+        if start_time is None:
+            raise ValueError("Not a traffic log: {}".format(path))
+
+        # A recorder that didn't close cleanly may leave a partial record.
+        if pos + _record.size > len(data):
+            return
+
+        (record_type, offset, server, channel, user, flags,
+         length) = _record.unpack_from(data, pos)
+        pos += _record.size
+
+        content = None
+        if record_type == MESSAGE_RECORD:
+            if pos + length > len(data):
+                return
+
+            content = data[pos:pos + length].decode("utf-8", "replace")
+            pos += length
+
+        yield Record(record_type, start_time + offset / 1000, server, channel,
+                     user, flags, length, content)
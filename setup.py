@@ -23,8 +23,9 @@ setup(
     author='gammafunk',
     author_email='gammafunk@gmail.com',
     packages=['cerebot'],
+    python_requires='>=3.5',
     extras_require={
-        ':python_version=="3.3"': ['asyncio'],
+        'uvloop': ['uvloop'],
     },
     setup_requires = [
         "irc",
@@ -35,6 +36,11 @@ setup(
     entry_points={
         'console_scripts': [
             'cerebot=cerebot.app:main',
+            'cerebot-bench=cerebot.bench:main',
+            'cerebot-gatewaybench=cerebot.gatewaybench:main',
+            'cerebot-journal=cerebot.journal:main',
+            'cerebot-relaybench=cerebot.relaybench:main',
+            'cerebot-replay=cerebot.replay:main',
         ],
     },
     classifiers=[
@@ -44,9 +50,8 @@ setup(
         "License :: OSI Approved :: GNU General Public License v2 (GPLv2)",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
         "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3.6",
     ],
     platforms='all',
     license='GPLv2',
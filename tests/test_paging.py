@@ -0,0 +1,118 @@
+"""Tests of joining and paging of multi-line relay output."""
+
+import asyncio
+import unittest
+
+from cerebot.bench import make_conf
+from cerebot.discord import DiscordSource
+from cerebot.fakes import FakeDCSSManager, FakeDiscordManager, FakeMessage
+
+
+class RelayPagingTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def make_manager(self, reply_lines, **options):
+        conf = make_conf()
+        conf.update(options)
+        dcss_manager = FakeDCSSManager(reply_lines=reply_lines)
+        manager = FakeDiscordManager(conf, dcss_manager)
+        channel = manager.servers[0].channels[0]
+        author = [m for m in manager.servers[0].members if not m.bot][0]
+        return manager, dcss_manager, channel, author
+
+    def send(self, manager, dcss_manager, channel, author, content):
+        async def run():
+            await manager.on_message(FakeMessage(channel, author, content))
+            while dcss_manager.reply_tasks or manager.reply_flushes:
+                await asyncio.wait(list(dcss_manager.reply_tasks)
+                                   + list(manager.reply_flushes))
+
+        self.loop.run_until_complete(run())
+
+    def test_reply_lines_are_paged(self):
+        manager, dcss_manager, channel, author = self.make_manager(
+            100, reply_flush_delay=0.01, page_size=800)
+
+        self.send(manager, dcss_manager, channel, author, "??pan")
+        self.assertEqual(len(manager.sent_messages), 1)
+        first = manager.sent_messages[0].content
+        self.assertLessEqual(len(first.split("\n(")[0]), 800)
+        self.assertIn("??pan: reply 0\n??pan: reply 1\n", first)
+        self.assertTrue(first.endswith("\n(1 more page, type `!more`)"))
+
+        self.send(manager, dcss_manager, channel, author, "!more")
+        self.assertEqual(len(manager.sent_messages), 2)
+        self.assertTrue(manager.sent_messages[1].content.startswith(
+            "??pan: reply "))
+
+    def test_pages_fit_in_a_discord_message(self):
+        for page_size in (0, 5000):
+            manager, dcss_manager, channel, author = self.make_manager(
+                200, reply_flush_delay=0.01, page_size=page_size)
+
+            self.send(manager, dcss_manager, channel, author, "??pan")
+            self.send(manager, dcss_manager, channel, author, "!more")
+            self.assertEqual(len(manager.sent_messages), 2)
+            for message in manager.sent_messages:
+                self.assertLessEqual(len(message.content), 2000)
+
+    def test_formatted_pages_fit_in_a_discord_message(self):
+        manager, dcss_manager, channel, author = self.make_manager(1)
+        source = DiscordSource(manager, channel)
+        text = "```" * 1000
+        pages = source.split_pages(text, "monster")
+        self.assertEqual("".join(pages), text)
+        for n, page in enumerate(pages):
+            message = (source.format_chat(page, "monster")
+                       + source.more_note(len(pages) - n - 1))
+            self.assertLessEqual(len(message), 2000)
+
+    def test_lines_sent_separately_without_delay(self):
+        manager, dcss_manager, channel, author = self.make_manager(
+            3, reply_flush_delay=0)
+
+        self.send(manager, dcss_manager, channel, author, "??pan")
+        self.assertEqual([m.content for m in manager.sent_messages],
+                         ["??pan: reply {}".format(n) for n in range(3)])
+
+    def test_message_types_are_sent_separately(self):
+        manager, dcss_manager, channel, author = self.make_manager(
+            2, reply_flush_delay=0.01)
+
+        self.send(manager, dcss_manager, channel, author, "@?hydra")
+        self.assertEqual(len(manager.sent_messages), 1)
+        self.assertEqual(manager.sent_messages[0].content,
+                         "```\n@?hydra: reply 0\n@?hydra: reply 1\n```")
+
+    def test_repeated_lines_in_one_reply_are_sent(self):
+        for lines in (["a", "b", "a"], ["a", "a"]):
+            manager, dcss_manager, channel, author = self.make_manager(1)
+            source = DiscordSource(manager, channel)
+            source.note_relay_query("??pan")
+            self.assertEqual(source.collapse_repeats(lines), lines)
+
+    def test_repeated_queries_are_replied_to_once(self):
+        manager, dcss_manager, channel, author = self.make_manager(
+            3, reply_flush_delay=0.05)
+        others = [m for m in manager.servers[0].members if not m.bot]
+
+        async def run():
+            for member in others[:2]:
+                await manager.on_message(FakeMessage(channel, member,
+                                                     "??pan"))
+            while dcss_manager.reply_tasks or manager.reply_flushes:
+                await asyncio.wait(list(dcss_manager.reply_tasks)
+                                   + list(manager.reply_flushes))
+
+        self.loop.run_until_complete(run())
+        self.assertEqual([m.content for m in manager.sent_messages],
+                         ["??pan: reply 0\n??pan: reply 1\n??pan: reply 2"])
+
+
+if __name__ == "__main__":
+    unittest.main()